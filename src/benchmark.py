@@ -0,0 +1,409 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import plotly
+import psycopg2
+from psycopg2 import sql
+
+import sst_db
+from sst_charts import CHART_INSTRUMENTS, partition_rows, plot_dashboard, plot_mass_error_combined, plot_response
+from sst_csv import build_insert_rows, validate_csv_format
+from sst_db import CANONICAL_PEPTIDES, apply_migrations, build_rollup_query, get_connection, insert_batch
+from sst_metrics import stage_summary
+from sst_snapshot import filter_frame, prepare_rollup, sync_frame
+
+logger = logging.getLogger("benchmark")
+
+# Export layouts the generator writes, by the name sst_csv registers them under
+CSV_LAYOUTS = ("Component", "Intact Mass", "Unifi")
+
+# Columns read for the charts, as on the page
+CHART_COLUMNS = ("ID", "Date", "Instrument", "Peptide", "Response", "Masserrorppm")
+
+# Days back from today per time period, as get_date_filter() on the page; "Data range" reads everything
+TIME_PERIOD_DAYS = {"Data range": None, "12 months": 365, "6 months": 183, "3 months": 92, "1 month": 31}
+
+# Rows per insert_batch() call when loading the synthetic history
+HISTORY_CHUNK_ROWS = 50000
+
+# Rows added before each incremental fetch, a few days of measurements
+INCREMENTAL_ROWS = 100
+
+# "Data" as the app was first deployed, before SCHEMA_MIGRATIONS; the migrations are applied on top
+BASE_TABLE_SQL = """
+CREATE TABLE "Data" (
+    "ID" serial PRIMARY KEY,
+    "Date" text,
+    "Response" numeric,
+    "Masserrorppm" numeric,
+    "Peptide" text,
+    "Samplename" text,
+    "Instrument" text,
+    "Kommentar" text
+)
+"""
+
+def synthetic_export(layout, rows, rng, instrument="Luke"):
+    """
+    A synthetic export in one of CSV_LAYOUTS as CSV bytes: the canonical peptides, mass errors around 0 ppm,
+    responses around 700000 and acquisition dates spread over the last year.
+    """
+    peptides = rng.choice(CANONICAL_PEPTIDES, rows)
+    mass_errors = rng.normal(0, 3, rows).round(2)
+    responses = rng.lognormal(13.5, 0.4, rows).round()
+    now = pd.Timestamp.now().floor('s')
+    dates = (now - pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, rows), unit='s')).strftime('%Y-%m-%d %H:%M:%S')
+
+    if layout == "Component":
+        columns = {
+            'Component': peptides,
+            'Mass error': mass_errors,
+            'MS response': responses,
+            'Item description': f"{instrument}-{now:%Y%m%d}-sst"
+        }
+    elif layout == "Intact Mass":
+        columns = {
+            'Type': "Product",
+            'Molecule ID': peptides,
+            'Component': peptides,
+            'Response': responses,
+            'Mass error (ppm)': mass_errors
+        }
+    elif layout == "Unifi":
+        columns = {
+            'Item Name CC': [f"SST_sample_{index:07d}" for index in range(rows)],
+            'Description CC': peptides,
+            'Component name': peptides,
+            'Response': responses,
+            'Mass error (ppm)': mass_errors
+        }
+    else:
+        raise ValueError(f"Unknown CSV layout: {layout}")
+    columns['Acquisition started date'] = dates
+    return pd.DataFrame(columns).to_csv(index=False).encode('utf-8')
+
+def synthetic_history(rows, years, rng, end=None):
+    """
+    Rows for insert_batch() over the given number of years up to end (default now): both chart instruments,
+    the canonical peptides, and a slow drift in mass error and response as between instrument calibrations.
+    """
+    end = pd.Timestamp.now().floor('s') if end is None else end
+    start = end - pd.Timedelta(days=years * 365.25)
+    seconds = np.sort(rng.integers(0, int((end - start).total_seconds()), rows))
+    dates = start + pd.to_timedelta(seconds, unit='s')
+    drift = np.sin(np.linspace(0, 6 * np.pi, rows))
+    mass_errors = (drift * 2 + rng.normal(0, 2, rows)).round(2)
+    responses = (rng.lognormal(13.5, 0.3, rows) * (1 + drift / 10)).round()
+    peptides = rng.choice(CANONICAL_PEPTIDES, rows)
+    instruments = rng.choice(CHART_INSTRUMENTS, rows)
+    return [
+        {
+            "Date": date.strftime('%Y-%m-%d %H:%M:%S'),
+            "Response": int(response),
+            "Masserrorppm": float(mass_error),
+            "Peptide": peptide,
+            "Samplename": f"SST_{date:%Y%m%d}_{index}",
+            "Instrument": instrument,
+            "Kommentar": ""
+        }
+        for index, (date, response, mass_error, peptide, instrument) in enumerate(
+            zip(dates, responses, mass_errors, peptides, instruments)
+        )
+    ]
+
+def period_since(period):
+    """The since date fetch_data() gets for a time period on the page"""
+    days = TIME_PERIOD_DAYS[period]
+    if days is None:
+        return None
+    return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+def measure(repeat, run, setup=None):
+    """Seconds taken by each of repeat calls of run(); setup(), when given, runs untimed before each call"""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def add_result(results, benchmark, params, timings, rows=None):
+    """Append one benchmark's timings with their summary; rows gives the throughput"""
+    median = statistics.median(timings)
+    result = {
+        'benchmark': benchmark,
+        'params': params,
+        'seconds': [round(seconds, 6) for seconds in timings],
+        'median': round(median, 6),
+        'min': round(min(timings), 6),
+        'max': round(max(timings), 6)
+    }
+    if rows is not None:
+        result['rows'] = rows
+        result['rows_per_second'] = round(rows / median) if median > 0 else None
+    results.append(result)
+    logger.info("%-26s %-60s median %9.4f s%s", benchmark, json.dumps(params), median,
+                f" ({result['rows_per_second']:,} rows/s)" if rows is not None and median > 0 else "")
+
+def result_key(result):
+    return result['benchmark'], json.dumps(result['params'], sort_keys=True)
+
+def maintenance_connection(maintenance_db):
+    """Autocommit connection to the server's maintenance database, for creating and dropping the benchmark database"""
+    conn = psycopg2.connect(**{**sst_db.conn_params, 'dbname': maintenance_db})
+    conn.autocommit = True
+    return conn
+
+def create_database(database, maintenance_db):
+    """Create an empty benchmark database, dropping a previous one, and point sst_db at it"""
+    conn = maintenance_connection(maintenance_db)
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(database)))
+        cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(database)))
+    conn.close()
+
+    sst_db.conn_params['dbname'] = database
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(BASE_TABLE_SQL)
+        conn.commit()
+        cursor.close()
+    apply_migrations()
+
+def drop_database(database, maintenance_db):
+    sst_db.close_pool()
+    conn = maintenance_connection(maintenance_db)
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(database)))
+    conn.close()
+
+def clear_data():
+    """Empty "Data" and its rollups; TRUNCATE does not fire the rollup triggers, so both are emptied"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('TRUNCATE "Data", "DailyRollup" RESTART IDENTITY')
+        conn.commit()
+        cursor.close()
+
+def server_version():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SHOW server_version")
+        version = cursor.fetchone()[0]
+        cursor.close()
+    return version
+
+def benchmark_csv(results, sizes, repeat, rng):
+    """validate_csv_format() for every layout and size, and insert throughput of the validated rows"""
+    for rows in sizes:
+        for layout in CSV_LAYOUTS:
+            content = synthetic_export(layout, rows, rng)
+            text = content.decode('utf-8')
+            outcome = {}
+
+            def validate():
+                outcome['result'] = validate_csv_format(text)
+
+            timings = measure(repeat, validate)
+            df, errors, _, _ = outcome['result']
+            if df is None or errors:
+                raise RuntimeError(f"Synthetic {layout} export did not validate: {errors[:3]}")
+            add_result(results, "validate_csv_format", {'layout': layout, 'rows': rows, 'bytes': len(content)}, timings, rows)
+
+        # The insert does not depend on the layout; the last one validated is inserted
+        insert_rows = build_insert_rows(df, "Luke", [""] * len(df))
+        timings = measure(repeat, lambda: insert_batch(insert_rows), setup=clear_data)
+        add_result(results, "insert_batch", {'rows': rows}, timings, rows)
+
+        # Uploading the same file again: every row is a duplicate
+        timings = measure(repeat, lambda: insert_batch(insert_rows))
+        add_result(results, "insert_batch_duplicates", {'rows': rows}, timings, rows)
+    clear_data()
+
+def load_history(results, rows, years, rng):
+    """Fill "Data" with the synthetic history; the load itself is recorded as a bulk insert result"""
+    history = synthetic_history(rows, years, rng)
+    start = time.perf_counter()
+    for chunk_start in range(0, len(history), HISTORY_CHUNK_ROWS):
+        insert_batch(history[chunk_start:chunk_start + HISTORY_CHUNK_ROWS])
+    add_result(results, "history_load", {'rows': rows, 'years': years, 'chunk_rows': HISTORY_CHUNK_ROWS},
+               [time.perf_counter() - start], rows)
+    # Fresh statistics, as autovacuum would have them on a table that grew over years
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('ANALYZE "Data"')
+        conn.commit()
+        cursor.close()
+
+def benchmark_fetch(results, repeat, rng):
+    """
+    fetch_data() without and with a previously loaded frame (see sync_frame()), the rollup queries,
+    and the time period filtering of a loaded frame as the snapshot fallback does it.
+    Returns the chart rows per time period for the plot benchmarks.
+    """
+    # Without a cached frame or snapshot, fetch_data() reads the rows through sync_frame()
+    frames = {}
+    for period in TIME_PERIOD_DAYS:
+        since = period_since(period)
+        timings = measure(repeat, lambda: frames.__setitem__(period, sync_frame(None, CHART_COLUMNS, since, CHART_INSTRUMENTS)))
+        add_result(results, "fetch_data", {'period': period}, timings, len(frames[period]))
+
+    # A few new rows since the last read; only they are transferred
+    since = period_since("Data range")
+    loaded = {}
+
+    def add_rows():
+        loaded['frame'] = sync_frame(None, CHART_COLUMNS, since, CHART_INSTRUMENTS)
+        insert_batch(synthetic_history(INCREMENTAL_ROWS, 0.01, rng))
+
+    timings = measure(repeat, lambda: sync_frame(loaded['frame'], CHART_COLUMNS, since, CHART_INSTRUMENTS), setup=add_rows)
+    add_result(results, "fetch_data_incremental", {'period': "Data range", 'new_rows': INCREMENTAL_ROWS}, timings, INCREMENTAL_ROWS)
+
+    for bucket in ("day", "week", "month"):
+        query, params = build_rollup_query(bucket, None, CHART_INSTRUMENTS)
+        rollup = {}
+
+        def fetch_rollup():
+            with get_connection() as conn:
+                rollup['frame'] = prepare_rollup(pd.read_sql_query(query, conn, params=params))
+
+        timings = measure(repeat, fetch_rollup)
+        add_result(results, "fetch_rollup", {'bucket': bucket}, timings, len(rollup['frame']))
+
+    everything = frames["Data range"]
+    for period in TIME_PERIOD_DAYS:
+        since = period_since(period)
+        filtered = {}
+        timings = measure(repeat, lambda: filtered.__setitem__('frame', filter_frame(everything, CHART_COLUMNS, since, CHART_INSTRUMENTS)))
+        add_result(results, "filter_frame", {'period': period, 'source_rows': len(everything)}, timings, len(filtered['frame']))
+    return frames
+
+def benchmark_plots(results, frames, repeat):
+    """Each plot builder per time period, with and without high-density mode, and the JSON sent to the browser"""
+    for period, df in frames.items():
+        df = df[df['Date'].notna()]
+        partitions = {}
+        timings = measure(repeat, lambda: partitions.__setitem__('rows', partition_rows(df)))
+        add_result(results, "partition_rows", {'period': period}, timings, len(df))
+        partitions = partitions['rows']
+
+        for high_density in (False, True):
+            builders = {
+                'plot_mass_error_combined': lambda: plot_mass_error_combined(
+                    partitions, "Luke", "Luke - Mass Error", period, high_density),
+                'plot_response': lambda: plot_response(partitions, "Luke", "Luke - MS Response", period, high_density),
+                'plot_dashboard': lambda: plot_dashboard(partitions, period, high_density)
+            }
+            for name, build in builders.items():
+                timings = measure(repeat, build)
+                add_result(results, name, {'period': period, 'high_density': high_density}, timings, len(df))
+
+            fig = builders['plot_dashboard']()
+            timings = measure(repeat, fig.to_json)
+            add_result(results, "figure_to_json", {'period': period, 'high_density': high_density,
+                                                   'bytes': len(fig.to_json())}, timings, len(df))
+
+def compare_results(results, previous_path):
+    """Log the change in median time against an earlier results file"""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = {result_key(result): result for result in json.load(f)['results']}
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None or not before['median']:
+            continue
+        change = (result['median'] - before['median']) / before['median'] * 100
+        logger.info("%-26s %-60s %9.4f s -> %9.4f s (%+.0f%%)", result['benchmark'], json.dumps(result['params']),
+                    before['median'], result['median'], change)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark CSV validation, inserts, fetching, filtering and the plot builders on synthetic data. "
+                    "Runs against a throwaway database on the server in the DB_* settings, which is created and dropped."
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Rows per synthetic CSV export, up to 1000000 (default: 1000 10000 100000)")
+    parser.add_argument("--history-rows", type=int, default=500000, help="Rows in the synthetic \"Data\" table (default: 500000)")
+    parser.add_argument("--history-years", type=float, default=3, help="Years of history the rows are spread over (default: 3)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the median is reported (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data (default: 0)")
+    parser.add_argument("--database", default="sst_benchmark", help="Throwaway database to create and drop (default: sst_benchmark)")
+    parser.add_argument("--maintenance-db", default="postgres", help="Database connected to for creating and dropping it (default: postgres)")
+    parser.add_argument("--keep-database", action="store_true", help="Keep the benchmark database afterwards, e.g. to inspect the plans")
+    parser.add_argument("--output", help="Results file (default: benchmarks/benchmark-<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare the medians with")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # The stage timings are collected for the results file instead of logged one by one
+    logging.getLogger("sst_metrics").setLevel(logging.WARNING)
+    # pandas warns on every read over a plain psycopg2 connection, as the app makes them
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+
+    if args.database == sst_db.conn_params['dbname']:
+        parser.error(f"--database {args.database} is the app's database (DB_NAME); the benchmark drops its database")
+
+    started_at = datetime.now()
+    output = args.output or os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                                         f"benchmark-{started_at:%Y%m%d-%H%M%S}.json")
+    rng = np.random.default_rng(args.seed)
+    results = []
+
+    create_database(args.database, args.maintenance_db)
+    try:
+        postgres_version = server_version()
+        logger.info("Benchmarking in database %s (PostgreSQL %s)", args.database, postgres_version)
+        benchmark_csv(results, args.rows, args.repeat, rng)
+        load_history(results, args.history_rows, args.history_years, rng)
+        frames = benchmark_fetch(results, args.repeat, rng)
+        benchmark_plots(results, frames, args.repeat)
+    finally:
+        if args.keep_database:
+            sst_db.close_pool()
+        else:
+            drop_database(args.database, args.maintenance_db)
+
+    report = {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'duration_seconds': round((datetime.now() - started_at).total_seconds(), 1),
+        'settings': {
+            'rows': args.rows,
+            'history_rows': args.history_rows,
+            'history_years': args.history_years,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'environment': {
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'plotly': plotly.__version__,
+            'psycopg2': psycopg2.__version__,
+            'postgres': postgres_version
+        },
+        'results': results,
+        # Time spent inside the app's instrumented stages (see sst_metrics) over the whole run
+        'stages': stage_summary()
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logger.info("Wrote %d results to %s", len(results), output)
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+if __name__ == '__main__':
+    main()
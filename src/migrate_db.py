@@ -0,0 +1,36 @@
+import argparse
+import logging
+
+from sst_db import SCHEMA_MIGRATIONS, apply_migrations, get_applied_migrations, get_connection
+
+logger = logging.getLogger("migrate_db")
+
+def show_status():
+    """Log every migration and whether it has been applied"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        done = get_applied_migrations(cursor)
+        conn.commit()
+        cursor.close()
+    for version, description, _ in SCHEMA_MIGRATIONS:
+        logger.info("%3d %-8s %s", version, "applied" if version in done else "pending", description)
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations to the SST database.")
+    parser.add_argument("--status", action="store_true", help="List the migrations and whether they have been applied, without changing anything")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.status:
+        show_status()
+        return
+
+    applied = apply_migrations()
+    for version, description in applied:
+        logger.info("Applied %d: %s", version, description)
+    if not applied:
+        logger.info("Schema is up to date")
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,76 @@
+import sys
+import os
+
+# Add the src directory to sys.path so the shared modules can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
 import streamlit as st
 import pandas as pd
 import psycopg2
 import matplotlib.pyplot as plt
 import seaborn as sns
 from dotenv import load_dotenv
-import os
-from io import StringIO
 import re
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import hashlib
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 
+from sst_charts import (
+    CHART_INSTRUMENTS,
+    HIGH_DENSITY_POINTS,
+    partition_rows,
+    plot_dashboard,
+    plot_mass_error_combined,
+    plot_response,
+)
+from sst_csv import (
+    build_insert_rows,
+    csv_read_options,
+    detect_instrument_from_filename,
+    plan_csv_read,
+    read_csv_header,
+    standardize_csv_frame,
+    validate_csv_file,
+    validate_csv_format,
+)
+from sst_db import (
+    build_rollup_query,
+    build_table_page_query,
+    ensure_schema,
+    get_connection,
+    get_data_version,
+    insert_batch,
+    insert_rows,
+    mark_data_changed,
+)
+from sst_jobs import get_job, submit_insert_job
+from sst_metrics import (
+    METRICS_PATH,
+    METRICS_WRITE_SECONDS,
+    frame_bytes,
+    increment,
+    log_to_stderr,
+    read_sql_timed,
+    record,
+    stage_summary,
+    start_metrics_writer,
+    timed,
+)
+from sst_snapshot import (
+    filter_frame,
+    page_frame,
+    prepare_rollup,
+    prepare_rows,
+    rollup_frame,
+    start_snapshot_refresh,
+    sync_frame,
+)
+
 st.set_page_config(
     page_title="SST Data and Visualization",
     page_icon=":chart_with_upwards_trend:",
@@ -29,14 +89,16 @@ st.markdown(
 
 load_dotenv()
 
-# Database connection parameters
-conn_params = {
-    'dbname': os.getenv('DB_NAME'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
+# Start of this run, for the page_run timing recorded at the end of the page
+page_started = time.perf_counter()
+
+@st.cache_resource
+def get_metrics_writer():
+    """Background thread writing the stage timings to METRICS_PATH, started once per process"""
+    return start_metrics_writer()
+
+log_to_stderr()
+get_metrics_writer()
 
 # Streamlit app
 col_title = st.markdown(
@@ -46,57 +108,25 @@ col_title = st.markdown(
         unsafe_allow_html=True
     )
 
-def insert_data_to_postgres(data):
+def insert_batch_to_postgres(rows):
+    """
+    Insert rows synchronously, showing database errors on the page; used by the manual entry form,
+    as uploads go through submit_insert_job(). Returns one outcome per row: "inserted", "duplicate" or "failed".
+    """
     try:
-        conn = psycopg2.connect(**conn_params)
-        cursor = conn.cursor()
-        
-        # Check for duplicates
-        check_query = """
-        SELECT COUNT(*) FROM "Data"
-        WHERE "Date" = %s 
-        AND "Response"::text = %s 
-        AND "Masserrorppm"::text = %s 
-        AND "Peptide" = %s 
-        AND "Samplename" = %s 
-        AND "Instrument" = %s 
-        AND "Kommentar" = %s
-        """
-        cursor.execute(check_query, (
-            data["Date"], 
-            str(data["Response"]),
-            str(data["Masserrorppm"]), 
-            data["Peptide"], 
-            data["Samplename"], 
-            data["Instrument"], 
-            data["Kommentar"]
-        ))
-        count = cursor.fetchone()[0]
-        
-        if count == 0:
-            # Insert data if no duplicates found
-            insert_query = """
-            INSERT INTO "Data" ("Date", "Response", "Masserrorppm", "Peptide", "Samplename", "Instrument", "Kommentar")
-            VALUES (%s, %s::numeric, %s::numeric, %s, %s, %s, %s)
-            """
-            cursor.execute(insert_query, (
-                data["Date"], 
-                str(data["Response"]),
-                str(data["Masserrorppm"]), 
-                data["Peptide"], 
-                data["Samplename"], 
-                data["Instrument"], 
-                data["Kommentar"]
-            ))
-            conn.commit()
-            st.sidebar.success("Data submitted successfully!")
-        else:
-            st.sidebar.warning("Duplicate data found. Data not inserted.")
-        
-        cursor.close()
-        conn.close()
+        return insert_batch(rows)
     except Exception as e:
-        st.sidebar.error(f"An error occurred: {e}")
+        st.error(f"An error occurred: {e}")
+        return ["failed"] * len(rows)
+
+def insert_data_to_postgres(data):
+    outcome = insert_batch_to_postgres([data])[0]
+    if outcome == "inserted":
+        # Rerun the whole page so the charts show the new row; the message is shown after the rerun
+        st.session_state.manual_entry_message = "Data submitted successfully!"
+        st.rerun()
+    elif outcome == "duplicate":
+        st.warning("Duplicate data found. Data not inserted.")
 
 # Sidebar for data input
 
@@ -122,10 +152,6 @@ Apomyoglobin,1.3,691565,Luke-20240101-sst""")
     st.write("• For other formats: Include instrument name (Luke/Leia) in filename")
 
 
-data_input = []
-# Add file upload option
-uploaded_file = st.sidebar.file_uploader("Upload CSV file (instrument name will be extracted from filename)", type=['csv'], key="csv_file_upload")
-
 # Initialize session states for CSV handling
 if 'comments' not in st.session_state:
     st.session_state.comments = []
@@ -135,435 +161,490 @@ if 'current_df' not in st.session_state:
     st.session_state.current_df = None
 if 'detected_instrument' not in st.session_state:
     st.session_state.detected_instrument = None
+if 'submit_jobs' not in st.session_state:
+    st.session_state.submit_jobs = []
+if 'submit_jobs_running' not in st.session_state:
+    st.session_state.submit_jobs_running = False
+if 'comment_grid_version' not in st.session_state:
+    st.session_state.comment_grid_version = 0
 
-# Handle uploaded file or pasted data
-if uploaded_file is not None:
-    # Extract instrument name from filename
-    filename = uploaded_file.name
-    if "Leia" in filename or "leia" in filename.lower():
-        st.session_state.detected_instrument = "Leia"
-        st.sidebar.success(f"🎯 Detected instrument: **Leia** from filename")
-    elif "Luke" in filename or "luke" in filename.lower():
-        st.session_state.detected_instrument = "Luke" 
-        st.sidebar.success(f"🎯 Detected instrument: **Luke** from filename")
-    else:
-        st.session_state.detected_instrument = None
-        st.sidebar.info(f"No instrument detected in filename. Please select manually below.")
-    
-    # Read the uploaded file
-    data_input = uploaded_file.getvalue().decode('utf-8')
-    st.sidebar.info(f"📁 **File uploaded:** {filename}")
-
-# Add instrument selection for CSV data
-if st.session_state.detected_instrument:
-    csv_instrument = st.session_state.detected_instrument
-    st.sidebar.info(f"🔧 **Using detected instrument:** {csv_instrument}")
-else:
-    csv_instrument = st.sidebar.selectbox("Select Instrument for CSV data", ["Luke", "Leia"], key="csv_instrument")
-
-# Add peptide selection for new format (when peptide info is missing)
-if 'current_df' in st.session_state and st.session_state.current_df is not None:
-    # Check if this is the new format by looking at the peptide values
-    sample_peptides = st.session_state.current_df['peptide'].unique()
-    if len(sample_peptides) > 0 and all(peptide == sample_peptides[0] for peptide in sample_peptides):
-        # All peptide values are the same (likely Molecule ID), so we need user to select
-        if sample_peptides[0] not in ['Insulin icodec', 'Semaglutide', 'Somapacitan']:
-            # For new format, the peptide IS the Molecule ID (e.g., "Apomyoglobin")
-            # (Alert removed - peptide detected silently)
-            pass
-
-# Advanced CSV validation and parsing
-if data_input or uploaded_file is not None:
-    def validate_csv_format(data_input):
-        """
-        Comprehensive CSV validation with detailed error reporting and field mapping
-        Enhanced for new Intact Mass format with Molecule ID handling
-        """
-        errors = []
-        warnings = []
-        
-        try:
-            # First, try to detect the structure without forcing column names
-            data = StringIO(data_input)
-            df_raw = pd.read_csv(data)
-
-            acquisition_col = next(
-                (col for col in df_raw.columns if col.strip().lower() == "acquisition started date"),
-                None,
-            )
+# Seconds between status checks while a background submission is running
+SUBMIT_POLL_SECONDS = 1
 
-            def extract_acquisition_dates(df_subset: pd.DataFrame, col_name=acquisition_col):
-                """Return Series of formatted acquisition dates aligned with df_subset."""
-                if col_name and col_name in df_subset.columns:
-                    parsed = pd.to_datetime(
-                        df_subset[col_name].reset_index(drop=True), errors='coerce'
-                    )
-                    formatted = parsed.dt.strftime('%Y-%m-%d')
-                    return formatted.where(~parsed.isna(), None)
-                return None
+# Number of validated uploads kept in memory; the least recently used are evicted first
+UPLOAD_CACHE_ENTRIES = 16
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def validate_upload(content_hash, manual_mapping_items, _content):
+    """
+    Decode and validate an uploaded CSV once per content hash and manual column mapping.
+    Reruns with an unchanged upload are served from the cache without parsing.
+    """
+    with timed("csv_decode") as info:
+        text = _content.decode('utf-8')
+        info['bytes'] = len(_content)
+    with timed("csv_validate") as info:
+        df, errors, warnings, column_info = validate_csv_format(text, dict(manual_mapping_items))
+        info['bytes'] = len(_content)
+        if df is not None:
+            info['rows'] = len(df)
+    return df, errors, warnings, column_info
+
+# Rows per chunk when streaming a CSV upload to the database
+STREAM_CHUNK_ROWS = 10000
+
+def stream_csv_to_postgres(file_obj, total_bytes, fallback_instrument, manual_mapping=None, on_progress=None):
+    """
+    Read, validate and insert a CSV in chunks of STREAM_CHUNK_ROWS rows over one transaction,
+    so only one chunk is held in memory at a time. Nothing is committed if any chunk is invalid.
+    Returns (inserted, duplicates, errors).
+    """
+    # The layout is detected once from the header, and every chunk reads only the columns it needs
+    file_obj.seek(0)
+    try:
+        header = read_csv_header(file_obj)
+    except Exception as e:
+        return 0, 0, [f"Error parsing CSV: {str(e)}"]
+    csv_format, plan, column_info = plan_csv_read(header, manual_mapping)
+    if csv_format is None:
+        return 0, 0, ["Unrecognized CSV layout"]
+    if plan is None:
+        missing_fields = [field for field in column_info['missing_fields'] if field not in (manual_mapping or {})]
+        return 0, 0, [f"Missing required fields: {', '.join(missing_fields)}. Turn off streaming to map columns manually."]
+    
+    inserted = 0
+    duplicates = 0
+    errors = []
+    try:
+        ensure_schema()
+        with get_connection() as conn:
+            cursor = conn.cursor()
             
-            # Check for different CSV formats
-            if 'Component' in df_raw.columns and 'Mass error' in df_raw.columns and 'MS response' in df_raw.columns and 'Item description' in df_raw.columns:
-                # New Component format detected
-                df_valid = df_raw[df_raw['Component'].notna() & (df_raw['Component'] != "")].copy()
-                
-                if len(df_valid) == 0:
-                    errors.append("No rows with valid Component found in the data")
-                    return None, errors, warnings
-                
-                # Map the new Component format columns to our expected format
-                try:
-                    # Create standardized DataFrame for Component format
-                    standardized_data = {
-                        'sample_id': df_valid['Component'].astype(str) + "_" + datetime.now().strftime("%Y%m%d"),
-                        'peptide': df_valid['Component'].astype(str),    # Use Component as peptide name
-                        'component': df_valid['Component'].astype(str),  # Same as peptide for this format
-                        'response': df_valid['MS response'],
-                        'mass_error': df_valid['Mass error'],
-                        'item_description': df_valid['Item description']  # For instrument detection
-                    }
-
-                    df_standardized = pd.DataFrame(standardized_data)
-
-                    acquisition_dates = extract_acquisition_dates(df_valid)
-                    if acquisition_dates is not None:
-                        df_standardized['acquisition_date'] = acquisition_dates
-
-                except KeyError as e:
-                    errors.append(f"Missing expected column in Component format: {str(e)}")
-                    return None, errors, warnings
-                    
-            elif 'Type' in df_raw.columns and 'Molecule ID' in df_raw.columns:
-                # New Intact Mass format detected - filter for rows with valid Molecule ID
-                # (processing continues without warning message)
-                
-                # Filter to only rows with non-empty Molecule ID (instead of just Product rows)
-                df_valid = df_raw[df_raw['Molecule ID'].notna() & (df_raw['Molecule ID'] != "")].copy()
-                
-                if len(df_valid) == 0:
-                    errors.append("No rows with valid Molecule ID found in the data")
-                    return None, errors, warnings
-                
-                # Show detected molecules (no warning message)
-                unique_molecules = df_valid['Molecule ID'].unique()
-                
-                # Map the new format columns to our expected format
-                try:
-                    # Create standardized DataFrame for new format
-                    # Use Molecule ID as peptide name (e.g., "Apomyoglobin")
-                    standardized_data = {
-                        'sample_id': df_valid['Molecule ID'].astype(str) + "_" + datetime.now().strftime("%Y%m%d"),
-                        'peptide': df_valid['Molecule ID'].astype(str),    # Use Molecule ID as peptide name
-                        'component': df_valid['Component'].astype(str),    # Use Component column if available
-                        'response': df_valid['Response'],
-                        'mass_error': df_valid['Mass error (ppm)']
-                    }
-
-                    df_standardized = pd.DataFrame(standardized_data)
-                    # Processing complete (no warning messages)
-
-                    acquisition_dates = extract_acquisition_dates(df_valid)
-                    if acquisition_dates is not None:
-                        df_standardized['acquisition_date'] = acquisition_dates
-
-                except KeyError as e:
-                    errors.append(f"Missing expected column in new format: {str(e)}")
-                    return None, errors, warnings
-                    
-            else:
-                # Original format handling
-                # Expected column patterns (multiple variations supported)
-                expected_patterns = {
-                    'sample_id': ['Item Name CC', 'item name cc', 'sample id', 'sampleid', 'sample name', 'item_name_cc'],
-                    'peptide': ['Description CC', 'description cc', 'peptide', 'component name', 'compound', 'description_cc'],
-                    'component': ['Component name', 'component name', 'component_name', 'component'],
-                    'response': ['Response', 'response', 'intensity', 'peak area', 'area'],
-                    'mass_error': ['Mass error (ppm)', 'mass error', 'mass_error_ppm', 'mass error ppm', 'ppm', 'mass_error']
-                }
+            file_obj.seek(0)
+            chunks = pd.read_csv(file_obj, chunksize=STREAM_CHUNK_ROWS, encoding='utf-8', **csv_read_options(header, plan))
+            for chunk in chunks:
+                df_chunk, chunk_errors, _ = standardize_csv_frame(chunk, csv_format, plan, allow_empty=True)
                 
-                # Analyze the actual columns in the data
-                actual_columns = [col.strip().lower() for col in df_raw.columns]
-                column_mapping = {}
-                missing_fields = []
+                if df_chunk is None:
+                    errors.extend(chunk_errors)
+                    # Format errors repeat in every chunk; row errors are collected from all chunks
+                    if not all(error.startswith("Row ") for error in chunk_errors):
+                        break
+                elif not errors:
+                    comments = [""] * len(df_chunk)
+                    outcomes = insert_rows(cursor, build_insert_rows(df_chunk, fallback_instrument, comments))
+                    inserted += outcomes.count("inserted")
+                    duplicates += outcomes.count("duplicate")
                 
-                st.sidebar.info(f"🔍 **Detected {len(actual_columns)} columns:** {', '.join(df_raw.columns)}")
-                
-                # Try to map each expected field to actual columns
-                for field_type, patterns in expected_patterns.items():
-                    mapped = False
-                    for pattern in patterns:
-                        if pattern.lower() in actual_columns:
-                            original_col = df_raw.columns[actual_columns.index(pattern.lower())]
-                            column_mapping[field_type] = original_col
-                            mapped = True
-                            break
-                    
-                    if not mapped:
-                        missing_fields.append(field_type)
-                
-                # If we have missing fields, show what's missing and provide manual mapping
-                if missing_fields:
-                    st.sidebar.error(f"❌ **Missing required fields:** {', '.join(missing_fields)}")
-                    
-                    # Allow user to manually map columns
-                    st.sidebar.write("**Manual Column Mapping:**")
-                    manual_mapping = {}
-                    
-                    for missing_field in missing_fields:
-                        field_name = missing_field.replace('_', ' ').title()
-                        if missing_field == 'sample_id':
-                            field_name = "Sample ID/Name"
-                        elif missing_field == 'mass_error':
-                            field_name = "Mass Error (ppm)"
-                        
-                        options = ["-- Select Column --"] + list(df_raw.columns)
-                        selected = st.sidebar.selectbox(
-                            f"Map '{field_name}' to:", 
-                            options, 
-                            key=f"map_{missing_field}"
-                        )
-                        if selected != "-- Select Column --":
-                            manual_mapping[missing_field] = selected
-                    
-                    # Update column mapping with manual selections
-                    column_mapping.update(manual_mapping)
-                    
-                    # Check if all fields are now mapped
-                    still_missing = [field for field in missing_fields if field not in manual_mapping]
-                    if still_missing:
-                        st.sidebar.warning(f"⚠️ Still missing: {', '.join(still_missing)}")
-                        return None, errors, warnings
-                
-                # Create standardized DataFrame with mapped columns
-                try:
-                    standardized_data = {}
-                    required_fields = ['sample_id', 'peptide', 'response', 'mass_error']
-                    
-                    for field in required_fields:
-                        if field in column_mapping:
-                            standardized_data[field] = df_raw[column_mapping[field]]
-                        else:
-                            errors.append(f"Required field '{field}' is not mapped")
-                            return None, errors, warnings
-                    
-                    # Add component field if available, otherwise use peptide
-                    if 'component' in column_mapping:
-                        standardized_data['component'] = df_raw[column_mapping['component']]
-                    else:
-                        standardized_data['component'] = standardized_data['peptide']
-                        warnings.append("Component column not found, using Peptide column instead")
-                    
-                    df_standardized = pd.DataFrame(standardized_data)
-
-                    acquisition_dates = extract_acquisition_dates(df_raw)
-                    if acquisition_dates is not None:
-                        df_standardized['acquisition_date'] = acquisition_dates
-
-                except Exception as e:
-                    errors.append(f"Error creating standardized data: {str(e)}")
-                    return None, errors, warnings
-                
-            # Validate data content for both formats
-            validation_errors = []
-            for index, row in df_standardized.iterrows():
-                row_errors = []
-                
-                # Check for empty required fields
-                if pd.isna(row['sample_id']) or str(row['sample_id']).strip() == "":
-                    row_errors.append("Missing Sample ID")
-                
-                if pd.isna(row['peptide']) or str(row['peptide']).strip() == "":
-                    row_errors.append("Missing Peptide name")
-                
-                # Validate numeric fields
-                try:
-                    response_val = float(str(row['response']).replace(',', '.'))
-                    if ',' in str(row['response']) and '.' in str(row['response']):
-                        row_errors.append("Response has both comma and decimal point")
-                except (ValueError, TypeError):
-                    row_errors.append(f"Invalid Response value: '{row['response']}'")
-                
-                try:
-                    mass_error_val = float(str(row['mass_error']).replace(',', '.'))
-                    if ',' in str(row['mass_error']) and '.' in str(row['mass_error']):
-                        row_errors.append("Mass error has both comma and decimal point")
-                except (ValueError, TypeError):
-                    row_errors.append(f"Invalid Mass error value: '{row['mass_error']}'")
-                
-                if row_errors:
-                    validation_errors.append(f"Row {index+1}: {'; '.join(row_errors)}")
-            
-            if validation_errors:
-                errors.extend(validation_errors)
-                return None, errors, warnings
+                if on_progress is not None and total_bytes:
+                    on_progress(min(file_obj.tell() / total_bytes, 1.0))
             
-            return df_standardized, errors, warnings
-                
-        except Exception as e:
-            errors.append(f"Error parsing CSV: {str(e)}")
-            return None, errors, warnings
+            # Nothing is committed when any chunk was invalid; the pool rolls the transaction back
+            if errors:
+                inserted = 0
+                duplicates = 0
+            else:
+                conn.commit()
+                if inserted > 0:
+                    mark_data_changed()
+            cursor.close()
+    except Exception as e:
+        inserted = 0
+        duplicates = 0
+        errors.append(f"Error streaming CSV: {str(e)}")
     
-    # Validate the CSV data
-    validated_df, validation_errors, validation_warnings = validate_csv_format(data_input)
+    return inserted, duplicates, errors
+
+@st.cache_resource
+def get_parse_pool():
+    """Process-wide pool of worker processes for parsing batch uploads, one per core"""
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def validate_batch(batch_key, _files):
+    """
+    Validate many uploaded files in parallel worker processes.
+    batch_key holds (filename, content hash) per file, so reruns with the same files hit the cache.
+    """
+    with timed("csv_validate_batch") as info:
+        pool = get_parse_pool()
+        futures = [pool.submit(validate_csv_file, filename, content) for filename, content in _files]
+        results = []
+        for (filename, _), future in zip(_files, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                # A worker died, e.g. killed for running out of memory on a large export
+                results.append({
+                    'filename': filename, 'instrument': None, 'df': None, 'warnings': [], 'column_info': None,
+                    'errors': ["Validation stopped: a worker process died, possibly out of memory. Try again or upload fewer files at once."],
+                    'worker_failed': True
+                })
+        if any(result.get('worker_failed') for result in results):
+            # A broken pool cannot run anything again, so the next batch starts a new one
+            pool.shutdown(wait=False, cancel_futures=True)
+            get_parse_pool.clear()
+        info['bytes'] = sum(len(content) for _, content in _files)
+    return results
+
+def comment_grid_key():
+    # A new key draws a fresh grid, e.g. after a comment was applied to many rows at once
+    return f"comment_grid_{st.session_state.comment_grid_version}"
+
+def apply_bulk_comment(selected_only):
+    """Button callback: put the bulk comment on every row, or on the rows ticked in the grid"""
+    comments = list(st.session_state.comments)
+    edited_rows = st.session_state.get(comment_grid_key(), {}).get('edited_rows', {})
+    # Comments typed in the grid are kept for the rows the bulk comment does not cover
+    for position, changes in edited_rows.items():
+        if 'Comment' in changes:
+            comments[int(position)] = changes['Comment'] or ""
+    selected = {int(position) for position, changes in edited_rows.items() if changes.get('Select')}
+    for position in range(len(comments)):
+        if not selected_only or position in selected:
+            comments[position] = st.session_state.bulk_comment
+    st.session_state.comments = comments
+    st.session_state.comment_grid_version += 1
+
+@st.fragment
+def csv_ingestion():
+    """
+    Upload, validation and submission of CSV files. Runs as a fragment, so working with an upload
+    reruns only this part of the page; writes rerun the whole page so the charts show the new rows.
+    """
+    data_input = []
+    uploaded_files = []
+    batch_mode = st.checkbox(
+        "Batch upload (multiple files)",
+        key="csv_batch_mode",
+        help="Validate many exports at once and submit them together. Comments are skipped."
+    )
+    # Add file upload option
+    if batch_mode:
+        uploaded_files = st.file_uploader("Upload CSV files (instrument name will be extracted from each filename)", type=['csv'], accept_multiple_files=True, key="csv_batch_upload")
+        uploaded_file = None
+    else:
+        uploaded_file = st.file_uploader("Upload CSV file (instrument name will be extracted from filename)", type=['csv'], key="csv_file_upload")
+
+    # Handle uploaded file or pasted data
+    if uploaded_file is not None:
+        # Extract instrument name from filename
+        filename = uploaded_file.name
+        st.session_state.detected_instrument = detect_instrument_from_filename(filename)
+        if st.session_state.detected_instrument:
+            st.success(f"🎯 Detected instrument: **{st.session_state.detected_instrument}** from filename")
+        else:
+            st.info(f"No instrument detected in filename. Please select manually below.")
     
-    if validation_errors:
-        st.sidebar.error("❌ **Validation Errors:**")
-        for error in validation_errors:
-            st.sidebar.write(f"• {error}")
-        st.session_state.current_df = None
+        # Read the uploaded file - decoding and parsing happen in validate_upload() on a cache miss
+        data_input = uploaded_file.getvalue()
+        st.info(f"📁 **File uploaded:** {filename}")
+
+    elif batch_mode:
+        # Instruments are detected per file; the selection below is the fallback
+        st.session_state.detected_instrument = None
+
+    # Add instrument selection for CSV data
+    if st.session_state.detected_instrument:
+        csv_instrument = st.session_state.detected_instrument
+        st.info(f"🔧 **Using detected instrument:** {csv_instrument}")
     else:
-        st.session_state.current_df = validated_df
-        st.sidebar.success(f"✅ Successfully validated {len(validated_df)} rows of data")
+        csv_instrument = st.selectbox("Select Instrument for CSV data", ["Luke", "Leia"], key="csv_instrument")
+
+    # Add peptide selection for new format (when peptide info is missing)
+    if 'current_df' in st.session_state and st.session_state.current_df is not None:
+        # Check if this is the new format by looking at the peptide values
+        sample_peptides = st.session_state.current_df['peptide'].unique()
+        if len(sample_peptides) > 0 and all(peptide == sample_peptides[0] for peptide in sample_peptides):
+            # All peptide values are the same (likely Molecule ID), so we need user to select
+            if sample_peptides[0] not in ['Insulin icodec', 'Semaglutide', 'Somapacitan']:
+                # For new format, the peptide IS the Molecule ID (e.g., "Apomyoglobin")
+                # (Alert removed - peptide detected silently)
+                pass
+
+    # Manual column mappings from the selectboxes drawn below in the previous run
+    manual_mapping = {
+        key[len("map_"):]: value for key, value in st.session_state.items()
+        if key.startswith("map_") and value != "-- Select Column --"
+    }
+
+    stream_mode = not batch_mode and st.checkbox(
+        "Stream large file directly to database",
+        key="csv_stream_mode",
+        help=f"Reads the file in chunks of {STREAM_CHUNK_ROWS} rows and inserts them as it goes. "
+             "Preview and comments are skipped, and nothing is saved if any row is invalid."
+    )
+
+    if stream_mode and uploaded_file is not None:
+        if st.button("Stream to database", key="stream_csv"):
+            progress_bar = st.progress(0.0, text="Streaming CSV to database...")
+            inserted, duplicates, stream_errors = stream_csv_to_postgres(
+                uploaded_file, uploaded_file.size, csv_instrument, manual_mapping, progress_bar.progress
+            )
+            progress_bar.progress(1.0, text="Streaming finished")
         
-        # Show preview of the data - show all rows that will be inserted
-        with st.sidebar.expander(f"📋 Data Preview ({len(validated_df)} rows to insert)", expanded=False):
-            if len(validated_df) <= 20:
-                # Show all rows if 20 or fewer
-                st.dataframe(validated_df, use_container_width=True)
+            if stream_errors:
+                st.error("❌ **Validation Errors - nothing was inserted:**")
+                for error in stream_errors:
+                    st.write(f"• {error}")
             else:
-                # For larger datasets, show first 10 and last 5 with summary
-                st.write(f"**First 10 rows:**")
-                st.dataframe(validated_df.head(10), use_container_width=True)
-                st.write(f"**... {len(validated_df) - 15} more rows ...**")
-                st.write(f"**Last 5 rows:**")
-                st.dataframe(validated_df.tail(5), use_container_width=True)
-
-# Show Submit CSV button only if comments are not already shown
-if not st.session_state.show_comments and st.sidebar.button("Submit CSV", key="submit_csv"):
-    if data_input or uploaded_file is not None:
-        st.session_state.show_comments = True
-        st.sidebar.info("Add comments for each data point below (optional):")
-    else:
-        st.sidebar.error("Please paste data or upload a file.")
-
-# Show comment fields if show_comments is True
-if st.session_state.show_comments and st.session_state.current_df is not None:
-    # Show comment fields for each row
-    for index, row in st.session_state.current_df.iterrows():
-        st.sidebar.text_area(
-            f"Add a comment for {row['peptide']}", 
-            height=68, 
-            key=f"comment_{index}"
+                # The result is shown after the whole page has rerun with the new rows
+                st.session_state.stream_result = (inserted, duplicates, csv_instrument)
+                st.rerun()
+
+    if 'stream_result' in st.session_state:
+        inserted, duplicates, stream_instrument = st.session_state.pop('stream_result')
+        st.success(f"✅ Successfully inserted {inserted} rows using instrument: **{stream_instrument}**")
+        if duplicates > 0:
+            st.warning(f"⚠️ Skipped {duplicates} duplicate rows already in the database")
+
+    if batch_mode and uploaded_files:
+        batch_files = [(file.name, file.getvalue()) for file in uploaded_files]
+        batch_key = tuple((filename, hashlib.sha256(content).hexdigest()) for filename, content in batch_files)
+        with st.spinner(f"Validating {len(batch_files)} files..."):
+            batch_results = validate_batch(batch_key, batch_files)
+        if any(result.get('worker_failed') for result in batch_results):
+            # The failure is not kept in the cache, so the files are validated again on the next run
+            validate_batch.clear()
+    
+        # Combined per-file validation report
+        valid_results = []
+        batch_report = []
+        batch_errors = []
+        for result in batch_results:
+            df_file = result['df']
+            if df_file is not None and 'item_description' in df_file.columns:
+                instrument_source = "Item description"
+            else:
+                instrument_source = result['instrument'] or f"{csv_instrument} (selected)"
+        
+            if result['errors']:
+                status = f"❌ {len(result['errors'])} errors"
+                batch_errors.extend(f"{result['filename']}: {error}" for error in result['errors'])
+            elif df_file is None:
+                status = "❌ Needs manual column mapping"
+                batch_errors.append(f"{result['filename']}: Columns could not be mapped automatically - upload it on its own to map them manually")
+            else:
+                status = f"✅ {len(df_file)} rows"
+                valid_results.append(result)
+            batch_report.append({'File': result['filename'], 'Instrument': instrument_source, 'Status': status})
+    
+        st.dataframe(pd.DataFrame(batch_report), use_container_width=True, hide_index=True)
+        if batch_errors:
+            with st.expander(f"View Validation Errors ({len(batch_results) - len(valid_results)} files)", expanded=False):
+                for error in batch_errors:
+                    st.write(f"• {error}")
+    
+        if valid_results and st.button(f"Submit {len(valid_results)} valid files", key="submit_batch"):
+            batch_rows = []
+            batch_labels = []
+            for result in valid_results:
+                df_file = result['df']
+                batch_rows.extend(build_insert_rows(df_file, result['instrument'] or csv_instrument, [""] * len(df_file)))
+                batch_labels.extend(f"{result['filename']} row {index+1} ({peptide})" for index, peptide in zip(df_file.index, df_file['peptide']))
+        
+            # One background bulk insert for all files
+            job_id = submit_insert_job(batch_rows, batch_labels, description=f"{len(batch_rows)} rows from {len(valid_results)} files")
+            st.session_state.submit_jobs.append(job_id)
+            # The job progress is shown outside this fragment
+            st.rerun()
+
+    # Advanced CSV validation and parsing
+    if (data_input or uploaded_file is not None) and not stream_mode:
+        upload_hash = hashlib.sha256(data_input).hexdigest()
+    
+        # Validate the CSV data
+        validated_df, validation_errors, validation_warnings, column_info = validate_upload(
+            upload_hash, tuple(sorted(manual_mapping.items())), data_input
         )
     
-    if st.sidebar.button("Final submit", key="submit_csv_comments"):
-        successful_inserts = 0
-        failed_inserts = 0
-        error_details = []
+        if column_info is not None:
+            st.info(f"🔍 **Detected {len(column_info['columns'])} columns:** {', '.join(column_info['columns'])}")
+            missing_fields = column_info['missing_fields']
         
-        # Process each row in the DataFrame (using standardized column names)
-        for index, row in st.session_state.current_df.iterrows():
-            try:
-                # Validate Response - auto-convert comma to decimal point and round to integer
-                try:
-                    response_raw = float(str(row["response"]).replace(',', '.'))
-                    response_value = round(response_raw)  # Round to nearest integer (no decimals)
-                except (ValueError, TypeError):
-                    error_details.append(f"Row {index+1}: Invalid Response value '{row['response']}' - must be numeric")
-                    failed_inserts += 1
-                    continue
-                
-                # Validate Mass error - auto-convert comma to decimal point
-                try:
-                    mass_error = float(str(row["mass_error"]).replace(',', '.'))
-                except (ValueError, TypeError):
-                    error_details.append(f"Row {index+1}: Invalid Mass error value '{row['mass_error']}' - must be numeric")
-                    failed_inserts += 1
-                    continue
-                
-                # Final check for missing required fields (should not happen after validation)
-                if pd.isna(row["sample_id"]) or str(row["sample_id"]).strip() == "":
-                    error_details.append(f"Row {index+1}: Missing Sample ID")
-                    failed_inserts += 1
-                    continue
-                    
-                if pd.isna(row["peptide"]) or str(row["peptide"]).strip() == "":
-                    error_details.append(f"Row {index+1}: Missing Peptide name")
-                    failed_inserts += 1
-                    continue
-                
-                # Get comment from the text_area widget using its key
-                comment_key = f"comment_{index}"
-                comment = st.session_state.get(comment_key, "") if comment_key in st.session_state else ""
-                
-                # Debug: Show what comment was found (remove this later)
-                if comment:
-                    st.write(f"Debug - Found comment for {row['peptide']}: '{comment}'")
-                
-                # Determine instrument: use Item description if available, otherwise use selected instrument
-                if 'item_description' in row and pd.notna(row['item_description']):
-                    item_desc = str(row['item_description']).lower()
-                    if 'leia' in item_desc:
-                        instrument = "Leia"
-                    elif 'luke' in item_desc:
-                        instrument = "Luke"
-                    else:
-                        instrument = csv_instrument  # Fallback to selected instrument
-                else:
-                    instrument = csv_instrument
+            # If we have missing fields, show what's missing and provide manual mapping
+            if missing_fields:
+                st.error(f"❌ **Missing required fields:** {', '.join(missing_fields)}")
+            
+                # Allow user to manually map columns
+                st.write("**Manual Column Mapping:**")
+                still_missing = []
+            
+                for missing_field in missing_fields:
+                    field_name = missing_field.replace('_', ' ').title()
+                    if missing_field == 'sample_id':
+                        field_name = "Sample ID/Name"
+                    elif missing_field == 'mass_error':
+                        field_name = "Mass Error (ppm)"
                 
-                acquisition_date = row.get("acquisition_date") if "acquisition_date" in row else None
-                if pd.notna(acquisition_date) and str(acquisition_date).strip():
-                    date_value = str(acquisition_date)
+                    options = ["-- Select Column --"] + column_info['columns']
+                    selected = st.selectbox(
+                        f"Map '{field_name}' to:", 
+                        options, 
+                        key=f"map_{missing_field}"
+                    )
+                    if selected == "-- Select Column --":
+                        still_missing.append(missing_field)
+            
+                if still_missing:
+                    st.warning(f"⚠️ Still missing: {', '.join(still_missing)}")
+    
+        if validation_errors:
+            st.error("❌ **Validation Errors:**")
+            for error in validation_errors:
+                st.write(f"• {error}")
+            st.session_state.current_df = None
+        elif validated_df is None:
+            st.session_state.current_df = None
+        else:
+            st.session_state.current_df = validated_df
+            st.success(f"✅ Successfully validated {len(validated_df)} rows of data")
+        
+            # Show preview of the data - show all rows that will be inserted
+            with st.expander(f"📋 Data Preview ({len(validated_df)} rows to insert)", expanded=False):
+                if len(validated_df) <= 20:
+                    # Show all rows if 20 or fewer
+                    st.dataframe(validated_df, use_container_width=True)
                 else:
-                    date_value = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    # For larger datasets, show first 10 and last 5 with summary
+                    st.write(f"**First 10 rows:**")
+                    st.dataframe(validated_df.head(10), use_container_width=True)
+                    st.write(f"**... {len(validated_df) - 15} more rows ...**")
+                    st.write(f"**Last 5 rows:**")
+                    st.dataframe(validated_df.tail(5), use_container_width=True)
 
-                data = {
-                    "Date": date_value,
-                    "Response": response_value,  # Now rounded integer without decimals
-                    "Masserrorppm": mass_error,
-                    "Peptide": row["peptide"],
-                    "Samplename": row["sample_id"],
-                    "Instrument": instrument,
-                    "Kommentar": comment
-                }
-                
-                # Insert data into PostgreSQL
-                insert_data_to_postgres(data)
-                successful_inserts += 1
-                
-            except Exception as e:
-                error_details.append(f"Row {index+1}: Unexpected error - {str(e)}")
-                failed_inserts += 1
-                continue
+    # Show Submit CSV button only if comments are not already shown
+    if not stream_mode and not st.session_state.show_comments and st.button("Submit CSV", key="submit_csv"):
+        if data_input or uploaded_file is not None:
+            st.session_state.show_comments = True
+            st.session_state.comments = []
+            st.session_state.comment_grid_version += 1
+            st.info("Add comments for each data point below (optional):")
+        else:
+            st.error("Please paste data or upload a file.")
+
+    # Show comment fields if show_comments is True
+    if not stream_mode and st.session_state.show_comments and st.session_state.current_df is not None:
+        df_submit = st.session_state.current_df
+        if len(st.session_state.comments) != len(df_submit):
+            st.session_state.comments = [""] * len(df_submit)
         
-        # Show summary of results
-        if successful_inserts > 0:
-            st.sidebar.success(f"✅ Successfully inserted {successful_inserts} rows using instrument: **{csv_instrument}**")
+        # One editable grid for all comments, however many rows the upload has
+        comment_grid = st.data_editor(
+            pd.DataFrame({
+                'Select': False,
+                'Row': df_submit.index + 1,
+                'Peptide': df_submit['peptide'].to_numpy(),
+                'Sample': df_submit['sample_id'].to_numpy(),
+                'Comment': st.session_state.comments
+            }),
+            key=comment_grid_key(),
+            hide_index=True,
+            use_container_width=True,
+            disabled=['Row', 'Peptide', 'Sample'],
+            column_config={
+                'Select': st.column_config.CheckboxColumn("✔", help="Rows the bulk comment is applied to with 'Apply to selected'"),
+                'Comment': st.column_config.TextColumn("Comment")
+            }
+        )
         
-        if failed_inserts > 0:
-            st.sidebar.error(f"❌ Failed to insert {failed_inserts} rows")
-            
-            # Show detailed errors in an expander
-            with st.sidebar.expander("View Error Details", expanded=True):
-                for error in error_details:
-                    st.sidebar.write(f"• {error}")
-                
-                st.sidebar.info("💡 **Suggestion**: If you have data validation errors, try entering the data manually using the form below instead of CSV paste.")
-                
-            # Show manual entry suggestion
-            st.sidebar.markdown("---")
-            st.sidebar.info("🔧 **Alternative**: Use the manual data entry form below to add individual data points.")
+        st.text_input("Bulk comment:", key="bulk_comment", placeholder="Comment for many rows at once")
+        col_all, col_selected = st.columns(2)
+        with col_all:
+            st.button("Apply to all", key="comment_apply_all", on_click=apply_bulk_comment, args=(False,))
+        with col_selected:
+            st.button("Apply to selected", key="comment_apply_selected", on_click=apply_bulk_comment, args=(True,))
+    
+        if st.button("Final submit", key="submit_csv_comments"):
+            # The comments go to the insert as one column
+            comments = comment_grid['Comment'].fillna("").tolist()
+            labels = [f"Row {index+1} ({peptide})" for index, peptide in zip(df_submit.index, df_submit['peptide'])]
+        
+            # Rows were parsed and validated once in validate_csv_format(), so they go straight to the insert,
+            # which runs in the background while the page stays usable
+            job_id = submit_insert_job(
+                build_insert_rows(df_submit, csv_instrument, comments),
+                labels,
+                description=f"{len(df_submit)} rows using instrument: **{csv_instrument}**"
+            )
+            st.session_state.submit_jobs.append(job_id)
         
-        # Reset states after processing (success or failure)
-        if successful_inserts > 0 or failed_inserts > 0:
+            # Reset states after submitting
             st.session_state.show_comments = False
             st.session_state.current_df = None
-            st.session_state.comments = []            
+            st.session_state.comments = []
+            st.rerun()
 
+with st.sidebar:
+    csv_ingestion()
+
+def show_submission_result(job):
+    """Summary of a finished submission job with per-row outcomes"""
+    outcomes = job['outcomes']
+    inserted = outcomes.count("inserted")
+    duplicates = outcomes.count("duplicate")
+    failed = outcomes.count("failed")
+    
+    if inserted > 0:
+        st.success(f"✅ Successfully inserted {inserted} of {job['description']}")
+    
+    if duplicates > 0:
+        st.warning(f"⚠️ Skipped {duplicates} duplicate rows already in the database")
+    
+    with st.expander("View Row Outcomes", expanded=False):
+        for label, outcome in zip(job['labels'], outcomes):
+            st.write(f"• {label}: {outcome}")
+    
+    if failed > 0:
+        st.error(f"❌ Failed to insert {failed} rows - the submission is stored in one transaction, so none of it was saved")
+        
+        # Show detailed errors in an expander
+        with st.expander("View Error Details", expanded=True):
+            for error in job['errors']:
+                st.write(f"• {error}")
+            for label, outcome in zip(job['labels'], outcomes):
+                if outcome == "failed":
+                    st.write(f"• {label}: Database insert failed")
+            
+            st.info("🔧 **Alternative**: Use the manual data entry form below to add individual data points.")
+
+def show_submission_jobs():
+    """Progress of background submissions; polls while any of them is still running"""
+    running = False
+    for job_id in list(st.session_state.submit_jobs):
+        job = get_job(job_id)
+        if job is None:
+            st.session_state.submit_jobs.remove(job_id)
+            continue
+        
+        if job['status'] == "finished":
+            show_submission_result(job)
+            if st.button("Dismiss", key=f"dismiss_{job_id}"):
+                st.session_state.submit_jobs.remove(job_id)
+                st.rerun()
+        else:
+            running = True
+            progress = job['done'] / job['total'] if job['total'] else 0.0
+            st.progress(progress, text=f"Submitting {job['description']} ({job['done']}/{job['total']} rows)")
+    
+    # Once everything has finished, rerun the whole page so the charts include the new data
+    if st.session_state.submit_jobs_running and not running:
+        st.session_state.submit_jobs_running = False
+        st.rerun()
+    st.session_state.submit_jobs_running = running
+
+if st.session_state.submit_jobs:
+    has_running_jobs = any(
+        job is not None and job['status'] != "finished"
+        for job in map(get_job, st.session_state.submit_jobs)
+    )
+    with st.sidebar:
+        st.fragment(run_every=SUBMIT_POLL_SECONDS if has_running_jobs else None)(show_submission_jobs)()
 
 st.sidebar.markdown("---")  # Add a separator
 
 st.sidebar.title("Enter SST Data")
 
-date = st.sidebar.date_input("Date")
-response = st.sidebar.text_input("Response")
-mass_error = st.sidebar.text_input("Mass error (ppm)")
-peptide = st.sidebar.selectbox("Peptide", ["Apomyoglobin", "Digest1", "Digest2", "Digest3"])
-samplename = st.sidebar.text_input("Samplename")
-instrument = st.sidebar.selectbox("Instrument", ["Luke", "Leia"])
-kommentar = st.sidebar.text_input("Kommentar")
-
 def is_valid_number(value):
     try:
         # Prøv at konvertere til float
@@ -590,66 +671,255 @@ def is_valid_mass_error(value):
     except ValueError:
         return False
 
-# Når du opretter data-ordbogen, skal du automatisk tilføje den aktuelle dato og tid
-if st.sidebar.button("Submit"):
-    error_messages = []
+@st.fragment
+def manual_entry():
+    """Form for a single data point; a fragment, so filling it in does not rerun the rest of the page"""
+    if 'manual_entry_message' in st.session_state:
+        st.success(st.session_state.pop('manual_entry_message'))
 
-    if not is_valid_number(response):
-        error_messages.append("Response should be a number with a decimal point (.), not a comma (,).")
+    date = st.date_input("Date")
+    response = st.text_input("Response")
+    mass_error = st.text_input("Mass error (ppm)")
+    peptide = st.selectbox("Peptide", ["Apomyoglobin", "Digest1", "Digest2", "Digest3"])
+    samplename = st.text_input("Samplename")
+    instrument = st.selectbox("Instrument", ["Luke", "Leia"])
+    kommentar = st.text_input("Kommentar")
+
+    # Når du opretter data-ordbogen, skal du automatisk tilføje den aktuelle dato og tid
+    if st.button("Submit"):
+        error_messages = []
+
+        if not is_valid_number(response):
+            error_messages.append("Response should be a number with a decimal point (.), not a comma (,).")
     
-    if not is_valid_number(mass_error):
-        error_messages.append("Mass error should be a number with a decimal point (.), not a comma (,).")
+        if not is_valid_number(mass_error):
+            error_messages.append("Mass error should be a number with a decimal point (.), not a comma (,).")
     
-    if not is_valid_samplename(samplename):
-        error_messages.append("Remember to fill out Samplename")
+        if not is_valid_samplename(samplename):
+            error_messages.append("Remember to fill out Samplename")
 
-    if error_messages:
-        for message in error_messages:
-            st.sidebar.error(message)
-    else:
-        try:
-            # Create a dictionary from the input data
-            data = {
-                "Date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),  # Automatically set current date and time
-                "Response": response,
-                "Masserrorppm": mass_error,
-                "Peptide": peptide,
-                "Samplename": samplename,
-                "Instrument": instrument,
-                "Kommentar": kommentar
-            }
+        if error_messages:
+            for message in error_messages:
+                st.error(message)
+        else:
+            try:
+                # Create a dictionary from the input data
+                data = {
+                    "Date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),  # Automatically set current date and time
+                    "Response": response,
+                    "Masserrorppm": mass_error,
+                    "Peptide": peptide,
+                    "Samplename": samplename,
+                    "Instrument": instrument,
+                    "Kommentar": kommentar
+                }
             
-            # Insert data into PostgreSQL
-            insert_data_to_postgres(data)
-        except Exception as e:
-            st.sidebar.error(f"An error occurred: {e}")
+                # Insert data into PostgreSQL
+                insert_data_to_postgres(data)
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+
+with st.sidebar:
+    manual_entry()
 
 # Add this right after the first submit button section
 
 
+# Seconds a fetched table is reused before it is read again; writes from this app invalidate it at once,
+# so the TTL only bounds how long changes made outside the app (e.g. the export watcher) take to show up
+DATA_CACHE_TTL = int(os.getenv('DATA_CACHE_TTL', 300))
+
+# Number of distinct queries (time period, peptides, columns) kept in the cache
+DATA_CACHE_ENTRIES = 32
+
+# Columns the charts read; "ID" is needed for the incremental refresh
+CHART_COLUMNS = ("ID", "Date", "Instrument", "Peptide", "Response", "Masserrorppm")
+
+# Columns shown in the data table
+TABLE_COLUMNS = ("ID", "Date", "Instrument", "Response", "Masserrorppm", "Peptide", "Samplename", "Kommentar")
+
+@st.cache_resource
+def get_snapshot():
+    """Local snapshot of the table, loaded once per process and refreshed in the background"""
+    return start_snapshot_refresh()
+
+@st.cache_resource
+def get_synced_frames():
+    """Last loaded frame per query, shared by all sessions, and the lock that guards it"""
+    return {}, threading.Lock()
+
+# Chart figures kept for reuse across reruns and sessions; the least recently used are dropped first
+FIGURE_CACHE_ENTRIES = 64
+
+@st.cache_resource
+def get_figure_cache():
+    """Built chart figures by their settings, shared by all sessions, and the lock that guards it"""
+    return OrderedDict(), threading.Lock()
+
+def cached_figure(key, build):
+    """
+    The figure cached under key, or the one build() returns, which is then cached.
+    Figures expire after DATA_CACHE_TTL like the data they were built from, as rows written by
+    other processes do not change this process's data version.
+    """
+    figures, lock = get_figure_cache()
+    now = time.monotonic()
+    with lock:
+        cached = figures.get(key)
+        if cached is not None and now - cached[0] < DATA_CACHE_TTL:
+            figures.move_to_end(key)
+            increment('cache_hits', "chart_build")
+            return cached[1]
+    with timed("chart_build"):
+        fig = build()
+    with lock:
+        figures[key] = (now, fig)
+        figures.move_to_end(key)
+        while len(figures) > FIGURE_CACHE_ENTRIES:
+            figures.popitem(last=False)
+    return fig
+
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def load_data(data_version, columns, since, instruments, peptides):
+    """
+    Read the selected columns and rows once per data version and share them across sessions.
+    After a change only the new rows are read (see sync_frame). The frame is sorted by the
+    parsed Date, and every caller gets its own copy, so it can be modified freely.
+    """
+    frames, lock = get_synced_frames()
+    key = (columns, since, instruments, peptides)
+    with timed("fetch_data") as info, lock:
+        df = frames.pop(key, None)
+        snapshot = get_snapshot()['frame']
+        if df is None and snapshot is not None:
+            # A new process starts from the local snapshot and only reads what changed since it was written
+            df = filter_frame(snapshot, columns, since, instruments, peptides)
+        df = sync_frame(df, columns, since, instruments, peptides)
+        frames[key] = df
+        # Frames for queries no longer in use, e.g. yesterday's period cutoffs, are dropped
+        while len(frames) > DATA_CACHE_ENTRIES:
+            del frames[next(iter(frames))]
+        info['rows'] = len(df)
+        info['bytes'] = frame_bytes(df)
+    return df.copy()
+
+@st.cache_data(ttl=DATA_CACHE_TTL, show_spinner=False)
+def load_peptides(data_version, instruments):
+    """Distinct peptide names measured on the given instruments"""
+    query = 'SELECT DISTINCT "Peptide" FROM "Data" WHERE "Instrument" = ANY(%s) ORDER BY 1'
+    with get_connection() as conn:
+        df = read_sql_timed("db_fetch_peptides", query, conn, [list(instruments)])
+    return df['Peptide'].dropna().tolist()
+
 # Fetch and display data from the PostgreSQL database
-def fetch_data():
+def fetch_data(columns=TABLE_COLUMNS, since=None, instruments=None, peptides=None):
+    """Rows on or after since (ISO date) for the given instruments and peptides; None means no filter"""
     try:
-        conn = psycopg2.connect(**conn_params)
-        query = 'SELECT * FROM "Data"'
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        
-        # Clean the Peptide column by stripping whitespace
-        if 'Peptide' in df.columns:
-            df['Peptide'] = df['Peptide'].str.strip()
-        
-        return df
+        return load_data(get_data_version(), tuple(columns), since,
+                         None if instruments is None else tuple(instruments),
+                         None if peptides is None else tuple(peptides))
+    except psycopg2.OperationalError as e:
+        snapshot = get_snapshot()
+        if snapshot['frame'] is None:
+            st.error(f"An error occurred: {e}")
+            return None
+        # Database unreachable: show the local snapshot read-only
+        show_offline_warning(snapshot)
+        return filter_frame(snapshot['frame'], columns, since, instruments, peptides)
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return None
+
+def show_offline_warning(snapshot):
+    """Shown once per run, however many reads fall back to the snapshot"""
+    if not st.session_state.offline_warning_shown:
+        st.warning(f"⚠️ The database is unreachable. Showing the local snapshot as of "
+                   f"{snapshot['refreshed_at']:%Y-%m-%d %H:%M} - new data cannot be saved.")
+        st.session_state.offline_warning_shown = True
+
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def load_table_page(data_version, sort_column, descending, after, limit, since, peptides, search):
+    """One page of the data table, read and cached on its own"""
+    ensure_schema()
+    query, params = build_table_page_query(
+        TABLE_COLUMNS, sort_column, descending, after, limit, since, None, peptides, search
+    )
+    with get_connection() as conn:
+        return prepare_rows(read_sql_timed("db_fetch_table_page", query, conn, params))
+
+def fetch_table_page(sort_column, descending, after, limit, since=None, peptides=None, search=None):
+    """Up to limit rows of the data table after the keyset position after; see build_table_page_query()"""
+    peptides = None if peptides is None else tuple(peptides)
+    try:
+        return load_table_page(get_data_version(), sort_column, descending, after, limit, since, peptides, search)
+    except psycopg2.OperationalError as e:
+        snapshot = get_snapshot()
+        if snapshot['frame'] is None:
+            st.error(f"An error occurred: {e}")
+            return None
+        show_offline_warning(snapshot)
+        return page_frame(snapshot['frame'], TABLE_COLUMNS, sort_column, descending, after, limit, since, None, peptides, search)
     except Exception as e:
         st.error(f"An error occurred: {e}")
         return None
 
-df = fetch_data()
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def load_rollup(data_version, bucket, since, instruments, peptides):
+    """Daily, weekly or monthly aggregates from the rollup table"""
+    ensure_schema()
+    query, params = build_rollup_query(bucket, since, instruments, peptides)
+    with get_connection() as conn:
+        return prepare_rollup(read_sql_timed("db_fetch_rollup", query, conn, params))
+
+def fetch_rollup(bucket, since=None, instruments=None, peptides=None):
+    """Aggregated chart data; see build_rollup_query()"""
+    instruments = None if instruments is None else tuple(instruments)
+    peptides = None if peptides is None else tuple(peptides)
+    try:
+        return load_rollup(get_data_version(), bucket, since, instruments, peptides)
+    except psycopg2.OperationalError as e:
+        snapshot = get_snapshot()
+        if snapshot['frame'] is None:
+            st.error(f"An error occurred: {e}")
+            return None
+        show_offline_warning(snapshot)
+        return rollup_frame(snapshot['frame'], bucket, since, instruments, peptides)
+    except Exception as e:
+        st.error(f"An error occurred: {e}")
+        return None
+
+st.session_state.offline_warning_shown = False
+
+try:
+    available_peptides = load_peptides(get_data_version(), CHART_INSTRUMENTS)
+except psycopg2.OperationalError as e:
+    snapshot = get_snapshot()['frame']
+    if snapshot is None:
+        st.error(f"An error occurred: {e}")
+        available_peptides = []
+    else:
+        available_peptides = sorted(snapshot.loc[snapshot['Instrument'].isin(CHART_INSTRUMENTS), 'Peptide'].dropna().unique())
+except Exception as e:
+    st.error(f"An error occurred: {e}")
+    available_peptides = []
+
+# Chart resolutions: None plots every measurement, otherwise the rollup bucket
+RESOLUTION_BUCKETS = {"Auto": None, "Every measurement": None, "Daily": "day", "Weekly": "week", "Monthly": "month"}
+
+# Resolution used by "Auto", so long periods plot a few hundred points per trace
+AUTO_RESOLUTION = {
+    "Data range": "week",
+    "All": "week",
+    "12 months": "day",
+    "6 months": "day",
+    "3 months": None,
+    "1 month": None
+}
 
 # Add time period filter controls
 st.subheader("Data Visualization Settings")
 
-col1, col2 = st.columns([2, 3])
+col1, col2, col3 = st.columns([2, 2, 3])
 
 with col1:
     time_period = st.selectbox(
@@ -658,8 +928,34 @@ with col1:
         index=0,
         help="Choose how far back in time to display data in the graphs. 'Data range' shows from first data entry."
     )
+    chart_resolution = st.selectbox(
+        "📊 Resolution:",
+        options=list(RESOLUTION_BUCKETS),
+        index=0,
+        help="'Auto' plots every measurement for up to 3 months, and daily or weekly averages for longer periods. "
+             "Choose 'Every measurement' to drill down to the raw data."
+    )
+    high_density = st.toggle(
+        "⚡ High-density mode",
+        help=f"Draw the graphs with WebGL and at most {HIGH_DENSITY_POINTS} points per line, chosen so peaks and dips stay visible. "
+             "Narrow the zoom window to see every point in it."
+    )
+    chart_layout = st.radio(
+        "🧩 Chart layout:",
+        options=["Separate charts", "Dashboard"],
+        horizontal=True,
+        help="'Dashboard' draws all four graphs as one figure with a shared date axis: zooming one graph zooms them all."
+    )
 
 with col2:
+    selected_peptides = st.multiselect(
+        "🧪 Peptides:",
+        options=available_peptides,
+        placeholder="All peptides",
+        help="Only show the selected peptides in the graphs and the data table. Leave empty to show all."
+    )
+
+with col3:
     # Add some vertical space to align with selectbox
     st.write("")  # Empty line for vertical alignment
     
@@ -693,373 +989,268 @@ def get_date_filter(period):
     else:
         return pd.Timestamp('2024-01-01')
 
-# Filter data to include only rows from selected time period
-if df is not None:
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce', format='mixed')
-    if df['Date'].isna().any():
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-    
-    # Apply time period filter
-    if time_period == "Data range":
-        # For "Data range", use all available data from first entry
-        df = df[df['Date'] >= df['Date'].min()]
-    else:
-        date_cutoff = get_date_filter(time_period)
-        df = df[df['Date'] >= date_cutoff]
-    
-    if len(df) == 0:
-        st.warning(f"No data available for the selected time period ({time_period}). Showing all available data.")
-        df = fetch_data()
-        df['Date'] = pd.to_datetime(df['Date'])
-        df = df[df['Date'] >= pd.Timestamp('2024-01-01')]
-
-    # Sort data by date
-    df = df.sort_values('Date')
+# The time period, instruments and peptides are filtered in the database, so only the rows shown are read.
+# "Data range" shows everything from the first entry; the other periods start at a whole day,
+# which keeps the query - and its cache entry - the same for the rest of the day.
+date_since = None if time_period == "Data range" else get_date_filter(time_period).strftime('%Y-%m-%d')
+peptide_filter = tuple(selected_peptides) or None
+rollup_bucket = AUTO_RESOLUTION[time_period] if chart_resolution == "Auto" else RESOLUTION_BUCKETS[chart_resolution]
+
+def fetch_chart_data(since):
+    """Raw rows, or per-bucket means with their aggregates when a rollup resolution is selected"""
+    if rollup_bucket is None:
+        return fetch_data(CHART_COLUMNS, since, CHART_INSTRUMENTS, peptide_filter)
+    return fetch_rollup(rollup_bucket, since, CHART_INSTRUMENTS, peptide_filter)
+
+df = fetch_chart_data(date_since)
+
+if df is not None and len(df) == 0 and date_since is not None:
+    st.warning(f"No data available for the selected time period ({time_period}). Showing all available data.")
+    date_since = get_date_filter("All").strftime('%Y-%m-%d')
+    df = fetch_chart_data(date_since)
+
+@st.fragment
+def visualization(df, time_period, date_since, peptide_filter, rollup_bucket, high_density, chart_layout):
+    """
+    The graphs for the rows read above. A fragment: the zoom window reruns only the graphs, and
+    the sidebar and the data table rerun without rebuilding them.
+    """
+    if df is not None:
+        # Dates arrive as datetimes sorted by load_data(); rows without a date cannot be plotted
+        df = df[df['Date'].notna()]
     
-    # Data is ready for visualization - no alert needed
+        # Data is ready for visualization - no alert needed
 
-    # Opret separate dataframes for Luke og Leia
-    df_luke = df[df['Instrument'] == 'Luke']
-    df_leia = df[df['Instrument'] == 'Leia']
+        chart_partitions = partition_rows(df)
 
-    def plot_masserrorppm(df, title):
-        fig = go.Figure()
-        
-        # Plot alle punkter undtagen det sidste
-        fig.add_trace(go.Scatter(
-            x=df['Date'][:-1], 
-            y=df['Masserrorppm'][:-1], 
-            mode='markers', 
-            name='Previous Data', 
-            marker=dict(color='blue'),
-            hovertemplate='<b>Previous Data</b><br>' +
-                          'Date: %{x}<br>' +
-                          'Mass error (ppm): %{y:.2f}<br>' +
-                          '<extra></extra>'
-        ))
-        
-        # Plot det sidste punkt i rødt
-        last_point = df.iloc[-1]
-        fig.add_trace(go.Scatter(
-            x=[last_point['Date']], 
-            y=[last_point['Masserrorppm']], 
-            mode='markers', 
-            name='Latest Data Point', 
-            marker=dict(color='red', size=10),
-            hovertemplate='<b>Latest Data Point</b><br>' +
-                          'Date: %{x}<br>' +
-                          'Mass error (ppm): %{y:.2f}<br>' +
-                          '<extra></extra>'
-        ))
-        
-        # Formatering af akser
-        fig.update_layout(
-            title=title, 
-            xaxis_title='Date', 
-            yaxis_title='Masserrorppm',
-            xaxis=dict(
-                tickformat='%Y-%m-%d',  # Kun dato
-                type='date'
+        # Plotly zoom is not reported back to the app, so high-density mode picks the visible window here;
+        # the points are downsampled within it and a narrow window shows them all
+        zoom_window = None
+        if high_density and len(df) > 0 and df['Date'].min().date() < df['Date'].max().date():
+            first_day, last_day = df['Date'].min().date(), df['Date'].max().date()
+            zoom_start, zoom_end = st.slider(
+                "🔍 Zoom window:",
+                min_value=first_day,
+                max_value=last_day,
+                value=(first_day, last_day),
+                format="YYYY-MM-DD"
             )
-        )
-        return fig
+            if (zoom_start, zoom_end) != (first_day, last_day):
+                zoom_window = (zoom_start, zoom_end)
+                window_start, window_end = pd.Timestamp(zoom_start), pd.Timestamp(zoom_end) + pd.Timedelta(days=1)
+                if rollup_bucket is not None:
+                    # The loaded frame holds rollup means; the window shows the individual measurements instead
+                    df_window = fetch_data(CHART_COLUMNS, zoom_start.strftime('%Y-%m-%d'), CHART_INSTRUMENTS, peptide_filter)
+                    if df_window is not None:
+                        chart_partitions = partition_rows(df_window[df_window['Date'].notna()])
+                    # Rollup dates are the start of their bucket, so the last bucket's measurements run past it
+                    if zoom_end == last_day:
+                        window_end = pd.Timestamp.max
+                chart_partitions = {
+                    key: rows[(rows['Date'] >= window_start) & (rows['Date'] < window_end)]
+                    for key, rows in chart_partitions.items()
+                }
+                chart_partitions = {key: rows for key, rows in chart_partitions.items() if len(rows) > 0}
 
-    def plot_mass_error_combined(df, title, time_period="All"):
-        """Kombineret Mass Error plot for alle peptider på ét instrument"""
-        fig = go.Figure()
-        
-        # Definer farver for hver peptid
-        colors = {
-            'Apomyoglobin': 'rgb(31, 119, 180)',  # Blå
-            'Digest1': 'rgb(255, 127, 14)',     # Orange
-            'Digest2': 'rgb(44, 160, 44)',      # Grøn
-            'Digest3': 'rgb(214, 39, 40)'       # Rød
-        }
-        
-        # Samle alle datoer fra faktisk plottede data (kun for "Data range")
-        all_plotted_dates = [] if time_period == "Data range" else None
-        
-        # Tilføj alle peptider til samme plot
-        for peptide in ['Apomyoglobin', 'Digest1', 'Digest2', 'Digest3']:
-            # Søg efter både versioner - med og uden underscore, og trim whitespace
-            df_peptide = df[(df['Peptide'].str.strip() == peptide) | 
-                            (df['Peptide'].str.strip() == f"{peptide}_")]
-            if len(df_peptide) > 0:  # Kun tilføj hvis der er data
-                # Tilføj datoerne fra dette peptid til listen (kun for "Data range")
-                if time_period == "Data range":
-                    all_plotted_dates.extend(df_peptide['Date'].tolist())
-                
-                fig.add_trace(go.Scatter(
-                    x=df_peptide['Date'], 
-                    y=df_peptide['Masserrorppm'], 
-                    mode='lines+markers', 
-                    name=peptide,
-                    line=dict(color=colors[peptide]),
-                    marker=dict(color=colors[peptide]),
-                    hovertemplate='<b>%{fullData.name}</b><br>' +
-                                  'Date: %{x}<br>' +
-                                  'Mass error (ppm): %{y:.2f}<br>' +
-                                  '<extra></extra>'  # Fjerner default hover box
-                ))
-        
-        # Tilføj røde linjer ved ±10 ppm
-        if time_period == "Data range" and all_plotted_dates:
-            # For "Data range" brug plottet data range
-            min_plotted_date = min(all_plotted_dates)
-            max_plotted_date = max(all_plotted_dates)
-            fig.add_shape(type="line", 
-                         x0=min_plotted_date, x1=max_plotted_date, 
-                         y0=10, y1=10, 
-                         line=dict(color="red", width=2, dash="dash"),
-                         name="+10 ppm limit")
-            fig.add_shape(type="line", 
-                         x0=min_plotted_date, x1=max_plotted_date, 
-                         y0=-10, y1=-10, 
-                         line=dict(color="red", width=2, dash="dash"),
-                         name="-10 ppm limit")
-        elif len(df) > 0:
-            # For andre tidsperioder brug hele dataset range (som før)
-            fig.add_shape(type="line", 
-                         x0=df['Date'].min(), x1=df['Date'].max(), 
-                         y0=10, y1=10, 
-                         line=dict(color="red", width=2, dash="dash"),
-                         name="+10 ppm limit")
-            fig.add_shape(type="line", 
-                         x0=df['Date'].min(), x1=df['Date'].max(), 
-                         y0=-10, y1=-10, 
-                         line=dict(color="red", width=2, dash="dash"),
-                         name="-10 ppm limit")
-        
-        # Formatering af akser
-        xaxis_config = {
-            'tickformat': '%Y-%m-%d',  # Kun dato
-            'type': 'date'
-        }
-        
-        # Kun for "Data range" sæt x-aksen til faktisk plottede data
-        if time_period == "Data range" and all_plotted_dates:
-            min_plotted_date = min(all_plotted_dates)
-            max_plotted_date = max(all_plotted_dates)
-            xaxis_config['range'] = [min_plotted_date, max_plotted_date]
-        # For alle andre tidsperioder: normal auto-range (som før)
-        
-        fig.update_layout(
-            title=title, 
-            xaxis_title='Date', 
-            yaxis_title='Mass Error (ppm)',
-            xaxis=xaxis_config,
-            yaxis=dict(
-                tickformat='.2f'
-            ),
-            height=400
-        )
-        return fig
+        # Figures are reused while the data and every setting that shapes them are unchanged;
+        # snapshot data shown while offline is not cached
+        figure_settings = (time_period, date_since, peptide_filter, rollup_bucket, high_density, zoom_window)
 
-    def plot_single_peptide(df, peptide_name, title):
-        """Plot for en enkelt peptid - håndterer både versioner med og uden underscore"""
-        fig = go.Figure()
-        
-        colors = {
-            'Apomyoglobin': 'rgb(31, 119, 180)',  # Blå
-            'Digest1': 'rgb(255, 127, 14)',     # Orange
-            'Digest2': 'rgb(44, 160, 44)'            # Grøn
-        }
-        
-        # Søg efter både versioner - med og uden underscore, og trim whitespace
-        df_peptide = df[(df['Peptide'].str.strip() == peptide_name) | 
-                        (df['Peptide'].str.strip() == f"{peptide_name}_")]
-        
-        if len(df_peptide) > 0:
-            fig.add_trace(go.Scatter(
-                x=df_peptide['Date'], 
-                y=df_peptide['Response'], 
-                mode='lines+markers', 
-                name=peptide_name,
-                line=dict(color=colors.get(peptide_name, 'rgb(128, 128, 128)')),
-                marker=dict(color=colors.get(peptide_name, 'rgb(128, 128, 128)')),
-                hovertemplate='<b>%{fullData.name}</b><br>' +
-                              'Date: %{x}<br>' +
-                              'Response: %{y:,.0f}<br>' +
-                              '<extra></extra>'  # Fjerner default hover box
-            ))
-        
-        # Formatering af akser
-        fig.update_layout(
-            title=title, 
-            xaxis_title='Date', 
-            yaxis_title='Response',
-            xaxis=dict(
-                tickformat='%Y-%m-%d',  # Kun dato
-                type='date'
-            ),
-            yaxis=dict(
-                tickformat='.2s',  # Smart formatering
-                separatethousands=True
-            )
-        )
-        return fig
+        def chart_figure(instrument, metric, build):
+            if st.session_state.offline_warning_shown:
+                return build()
+            return cached_figure((get_data_version(), instrument, metric, *figure_settings), build)
 
-    def plot_response(df, title, time_period="All"):
-        fig = go.Figure()
-        
-        # Definer farver for hver peptid
-        colors = {
-            'Apomyoglobin': 'rgb(31, 119, 180)',  # Blå
-            'Digest1': 'rgb(255, 127, 14)',     # Orange
-            'Digest2': 'rgb(44, 160, 44)',      # Grøn
-            'Digest3': 'rgb(214, 39, 40)'       # Rød
-        }
-        
-        # Samle alle datoer fra faktisk plottede data (kun for "Data range")
-        all_plotted_dates = [] if time_period == "Data range" else None
-        
-        # Tilføj alle peptider til samme plot
-        for peptide in ['Apomyoglobin', 'Digest1', 'Digest2', 'Digest3']:
-            # Søg efter både versioner - med og uden underscore, og trim whitespace
-            df_peptide = df[(df['Peptide'].str.strip() == peptide) | 
-                            (df['Peptide'].str.strip() == f"{peptide}_")]
-            if len(df_peptide) > 0:  # Kun tilføj hvis der er data
-                # Tilføj datoerne fra dette peptid til listen (kun for "Data range")
-                if time_period == "Data range":
-                    all_plotted_dates.extend(df_peptide['Date'].tolist())
-                
-                fig.add_trace(go.Scatter(
-                    x=df_peptide['Date'], 
-                    y=df_peptide['Response'], 
-                    mode='lines+markers', 
-                    name=peptide,
-                    line=dict(color=colors[peptide]),
-                    marker=dict(color=colors[peptide]),
-                    hovertemplate='<b>%{fullData.name}</b><br>' +
-                                  'Date: %{x}<br>' +
-                                  'Response: %{y:,.0f}<br>' +
-                                  '<extra></extra>'  # Fjerner default hover box
-                ))
-        
-        # Formatering af akser
-        xaxis_config = {
-            'tickformat': '%Y-%m-%d',  # Kun dato, ikke tidspunkt
-            'type': 'date'
-        }
-        
-        # Kun for "Data range" sæt x-aksen til faktisk plottede data
-        if time_period == "Data range" and all_plotted_dates:
-            min_plotted_date = min(all_plotted_dates)
-            max_plotted_date = max(all_plotted_dates)
-            xaxis_config['range'] = [min_plotted_date, max_plotted_date]
-        # For alle andre tidsperioder: normal auto-range (som før)
-        
-        fig.update_layout(
-            title=title, 
-            xaxis_title='Date', 
-            yaxis_title='Response',
-            xaxis=xaxis_config,
-            yaxis=dict(
-                tickformat='.2s',  # Maksimalt 2 decimaler, smart formatering
-                separatethousands=True  # Tusindtalsseparatorer
-            )
-        )
-        return fig
+        def render_chart(fig):
+            # Timed apart from the build, as serializing a large figure for the browser takes time of its own
+            with timed("chart_render"):
+                st.plotly_chart(fig, use_container_width=True)
 
-    # Opret Mass Error plots
-    st.subheader("Mass Error Analysis")
+        if chart_layout == "Dashboard":
+            dashboard_fig = chart_figure(None, "Dashboard", lambda: plot_dashboard(chart_partitions, time_period, high_density))
+            render_chart(dashboard_fig)
+        else:
+            # Opret Mass Error plots
+            st.subheader("Mass Error Analysis")
     
-    # Create two columns for Luke and Leia Mass Error plots side by side
-    col1, col2 = st.columns(2)
+            # Create two columns for Luke and Leia Mass Error plots side by side
+            col1, col2 = st.columns(2)
     
-    with col1:
-        # Luke Mass Error plot - alle komponenter kombineret
-        luke_mass_error_fig = plot_mass_error_combined(df_luke, "Luke - Mass Error", time_period)
-        st.plotly_chart(luke_mass_error_fig, use_container_width=True)
+            with col1:
+                # Luke Mass Error plot - alle komponenter kombineret
+                luke_mass_error_fig = chart_figure("Luke", "Masserrorppm", lambda: plot_mass_error_combined(
+                    chart_partitions, "Luke", "Luke - Mass Error", time_period, high_density))
+                render_chart(luke_mass_error_fig)
     
-    with col2:
-        # Leia Mass Error plot - alle komponenter kombineret
-        leia_mass_error_fig = plot_mass_error_combined(df_leia, "Leia - Mass Error", time_period)
-        st.plotly_chart(leia_mass_error_fig, use_container_width=True)
+            with col2:
+                # Leia Mass Error plot - alle komponenter kombineret
+                leia_mass_error_fig = chart_figure("Leia", "Masserrorppm", lambda: plot_mass_error_combined(
+                    chart_partitions, "Leia", "Leia - Mass Error", time_period, high_density))
+                render_chart(leia_mass_error_fig)
     
-    # Opret separate MS Response plots
-    st.subheader("MS Response Analysis")
+            # Opret separate MS Response plots
+            st.subheader("MS Response Analysis")
     
-    # Create two columns for Luke and Leia MS Response plots side by side
-    col3, col4 = st.columns(2)
+            # Create two columns for Luke and Leia MS Response plots side by side
+            col3, col4 = st.columns(2)
     
-    with col3:
-        # Luke MS Response plot
-        luke_response_fig = plot_response(df_luke, "Luke - MS Response", time_period)
-        st.plotly_chart(luke_response_fig, use_container_width=True)
+            with col3:
+                # Luke MS Response plot
+                luke_response_fig = chart_figure("Luke", "Response", lambda: plot_response(
+                    chart_partitions, "Luke", "Luke - MS Response", time_period, high_density))
+                render_chart(luke_response_fig)
     
-    with col4:
-        # Leia MS Response plot  
-        leia_response_fig = plot_response(df_leia, "Leia - MS Response", time_period)
-        st.plotly_chart(leia_response_fig, use_container_width=True)
+            with col4:
+                # Leia MS Response plot  
+                leia_response_fig = chart_figure("Leia", "Response", lambda: plot_response(
+                    chart_partitions, "Leia", "Leia - MS Response", time_period, high_density))
+                render_chart(leia_response_fig)
 
-else:
-    st.write("No data available.")
+    else:
+        st.write("No data available.")
 
-with st.expander("View Data Table", expanded=False):
-    if df is not None:
-        # Sort the dataframe by date, newest first
-        df_sorted = df.sort_values('Date', ascending=False)
-        
-        # Convert 'Date' column to datetime if it's not already
-        df_sorted['Date'] = pd.to_datetime(df_sorted['Date'])
+visualization(df, time_period, date_since, peptide_filter, rollup_bucket, high_density, chart_layout)
+
+# Rows per page offered in the data table
+TABLE_PAGE_SIZES = [25, 50, 100, 250]
+
+# Columns the data table can be sorted by; text columns are found with the search instead
+TABLE_SORT_COLUMNS = ["Date", "ID", "Response", "Masserrorppm"]
+
+def keyset_value(value):
+    """Plain Python value of a table cell for the page position; empty cells become None"""
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, 'item') else value
+
+@st.fragment
+def data_table(date_since, peptide_filter, has_data):
+    """Paged data table; a fragment, so searching and paging do not rerun the graphs"""
+    with st.expander("View Data Table", expanded=False):
+        # Only the visible page is read; sorting and the text filter run in the database
+        col_search, col_sort, col_order, col_size = st.columns([3, 2, 2, 1])
+        with col_search:
+            table_search = st.text_input("🔎 Search:", key="table_search", placeholder="Instrument, peptide, sample or comment")
+        with col_sort:
+            table_sort = st.selectbox("Sort by:", TABLE_SORT_COLUMNS, key="table_sort")
+        with col_order:
+            table_order = st.selectbox("Order:", ["Descending", "Ascending"], key="table_order")
+        with col_size:
+            table_page_size = st.selectbox("Rows:", TABLE_PAGE_SIZES, key="table_page_size")
+    
+        # Start positions of the pages visited so far; back to the first page whenever the query changes
+        table_query = (date_since, peptide_filter, table_search, table_sort, table_order, table_page_size)
+        if st.session_state.get('table_query') != table_query:
+            st.session_state.table_query = table_query
+            st.session_state.table_pages = [None]
+    
+        descending = table_order == "Descending"
+        # One extra row tells whether there is a next page
+        df_page = None
+        if has_data:
+            df_page = fetch_table_page(
+                table_sort, descending, st.session_state.table_pages[-1], table_page_size + 1,
+                date_since, peptide_filter, table_search.strip() or None
+            )
+    
+        if df_page is not None:
+            has_next_page = len(df_page) > table_page_size
+            df_page = df_page.head(table_page_size)
+            if has_next_page:
+                # The next page starts after the last row, by its unformatted sort value
+                next_page = (keyset_value(df_page[table_sort].iloc[-1]), int(df_page['ID'].iloc[-1]))
         
-        # Format the date as 'YYYY-MM-DD'
-        df_sorted['Date'] = df_sorted['Date'].dt.strftime('%Y-%m-%d')
+            # Format the date as 'YYYY-MM-DD'
+            df_page['Date'] = df_page['Date'].dt.strftime('%Y-%m-%d')
         
-        # Reorder columns to include ID first
-        columns_order = ['ID', 'Date', 'Instrument', 'Response', 'Masserrorppm', 'Peptide', 'Samplename', 'Kommentar']
-        df_sorted = df_sorted[columns_order]
+            # Display the dataframe without index
+            st.dataframe(df_page, use_container_width=True, hide_index=True)
         
-        # Display the dataframe without index
-        st.dataframe(df_sorted, use_container_width=True, hide_index=True)
-    else:
-        st.write("No data available to display.")
+            col_prev, col_page, col_next = st.columns([1, 4, 1])
+            # The page position changes in the button callbacks, before the table reruns
+            with col_prev:
+                st.button("◀ Previous", key="table_prev", disabled=len(st.session_state.table_pages) == 1,
+                          on_click=st.session_state.table_pages.pop)
+            with col_page:
+                st.caption(f"Page {len(st.session_state.table_pages)}")
+            with col_next:
+                st.button("Next ▶", key="table_next", disabled=not has_next_page,
+                          on_click=st.session_state.table_pages.append, args=(next_page if has_next_page else None,))
+        else:
+            st.write("No data available to display.")
         
+
+data_table(date_since, peptide_filter, df is not None)
+
 def delete_data_by_id(id_number):
     try:
-        conn = psycopg2.connect(**conn_params)
-        cursor = conn.cursor()
-        
         # Slet direkte baseret på ID
         delete_query = """
         DELETE FROM "Data"
         WHERE "ID" = %s
         """
-        cursor.execute(delete_query, (id_number,))
-        affected_rows = cursor.rowcount
-        conn.commit()
-        
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            with timed("db_delete") as info:
+                cursor.execute(delete_query, (id_number,))
+                affected_rows = cursor.rowcount
+                info['rows'] = affected_rows
+            conn.commit()
+            cursor.close()
+        if affected_rows > 0:
+            mark_data_changed()
         
         return affected_rows
     except Exception as e:
         st.error(f"An error occurred: {e}")
         return 0
 
-with st.expander("Delete Data", expanded=False):
-    st.warning("Caution: This action will permanently delete data.")
-    id_to_delete = st.number_input("Enter the ID number of the row to delete:", min_value=1, step=1)
+@st.fragment
+def deletion():
+    """Deletion by ID with confirmation; a fragment, so the steps do not rerun the rest of the page"""
+    with st.expander("Delete Data", expanded=False):
+        if 'delete_message' in st.session_state:
+            st.success(st.session_state.pop('delete_message'))
+        st.warning("Caution: This action will permanently delete data.")
+        id_to_delete = st.number_input("Enter the ID number of the row to delete:", min_value=1, step=1)
     
-    if st.button("Request Deletion"):
-        if id_to_delete:
-            st.session_state.show_confirmation = True
-            st.session_state.id_to_delete = id_to_delete
-        else:
-            st.error("Please enter an ID number to delete.")
+        if st.button("Request Deletion"):
+            if id_to_delete:
+                st.session_state.show_confirmation = True
+                st.session_state.id_to_delete = id_to_delete
+            else:
+                st.error("Please enter an ID number to delete.")
 
-    if 'show_confirmation' in st.session_state and st.session_state.show_confirmation:
-        st.warning(f"Are you sure you want to delete row with ID {id_to_delete}?")
-        user_initials = st.text_input("Enter your initials to confirm:")
+        if 'show_confirmation' in st.session_state and st.session_state.show_confirmation:
+            st.warning(f"Are you sure you want to delete row with ID {id_to_delete}?")
+            user_initials = st.text_input("Enter your initials to confirm:")
         
-        if st.button("Confirm Deletion"):
-            if user_initials:
-                affected_rows = delete_data_by_id(st.session_state.id_to_delete)
-                if affected_rows > 0:
-                    st.success(f"Row with ID {st.session_state.id_to_delete} deleted successfully by {user_initials}.")
+            if st.button("Confirm Deletion"):
+                if user_initials:
+                    affected_rows = delete_data_by_id(st.session_state.id_to_delete)
+                    st.session_state.show_confirmation = False
+                    if affected_rows > 0:
+                        # Rerun the whole page so the graphs and the table drop the row; the message is shown after the rerun
+                        st.session_state.delete_message = f"Row with ID {st.session_state.id_to_delete} deleted successfully by {user_initials}."
+                        st.rerun()
+                    else:
+                        st.info("No matching data found to delete.")
                 else:
-                    st.info("No matching data found to delete.")
-                st.session_state.show_confirmation = False
-            else:
-                st.error("Please enter your initials to confirm the deletion.")
\ No newline at end of file
+                    st.error("Please enter your initials to confirm the deletion.")
+
+deletion()
+
+# Hidden performance panel, opened by adding ?admin=1 to the page address
+if st.query_params.get("admin") == "1":
+    with st.expander("⏱️ Performance", expanded=True):
+        summary = stage_summary()
+        if summary:
+            st.dataframe(pd.DataFrame(summary), hide_index=True, use_container_width=True)
+        else:
+            st.write("No stages timed yet.")
+        st.caption(f"p50 and p95 over the most recent runs of each stage in this process. "
+                   f"Prometheus metrics are written to {METRICS_PATH} every {METRICS_WRITE_SECONDS} s.")
+
+record("page_run", time.perf_counter() - page_started)
@@ -0,0 +1,358 @@
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from sst_db import CANONICAL_PEPTIDES
+
+def lttb_indices(x, y, threshold):
+    """
+    Positions of the points kept when downsampling (x, y) to threshold points with
+    Largest-Triangle-Three-Buckets, which keeps the peaks and dips a plain stride would skip.
+    x must be ascending. The first and last points are always kept; with threshold >= len(x) every point is.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype='float64')
+    x = x - x[0]  # Dates arrive as nanoseconds; smaller numbers keep the areas precise
+    y = np.asarray(y, dtype='float64')
+
+    # The inner points are split into threshold - 2 buckets of nearly equal size, one point is kept per bucket
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The third corner is the mean of the next bucket, or the last point after the last bucket
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        mean_x = x[next_start:next_end].mean()
+        mean_y = y[next_start:next_end].mean()
+        # Twice the area of the triangle (previous kept point, candidate, next mean) for every candidate
+        area = np.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+    return kept
+
+def downsample_frame(df, x_column, y_column, threshold):
+    """
+    Rows of df, sorted by x_column, downsampled to at most threshold rows by the shape of y_column.
+    Rows without a y value are left out, as a chart cannot place them.
+    """
+    df = df[df[y_column].notna()]
+    if len(df) <= threshold:
+        return df
+    x = df[x_column]
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('int64')
+    return df.iloc[lttb_indices(x.to_numpy(), df[y_column].to_numpy(), threshold)]
+
+# Instruments shown in the charts
+CHART_INSTRUMENTS = ("Luke", "Leia")
+
+# Farve for hver peptid i graferne
+PEPTIDE_COLORS = {
+    'Apomyoglobin': 'rgb(31, 119, 180)',  # Blå
+    'Digest1': 'rgb(255, 127, 14)',     # Orange
+    'Digest2': 'rgb(44, 160, 44)',      # Grøn
+    'Digest3': 'rgb(214, 39, 40)'       # Rød
+}
+
+# Points per trace in high-density mode, about two per pixel across a half-width chart
+HIGH_DENSITY_POINTS = 1000
+
+def partition_rows(df):
+    """
+    Rows split by (instrument, peptide). Names are normalized when stored, so one pass splits them;
+    the charts look up their traces by key instead of scanning the names.
+    """
+    return {key: rows for key, rows in df.groupby(['Instrument', 'Peptide'], sort=False)}
+
+def scatter_type(high_density):
+    """Trace type of the charts: WebGL in high-density mode"""
+    return go.Scattergl if high_density else go.Scatter
+
+def chart_rows(df, y_column, high_density):
+    """Rows plotted by a trace: all of them, or in high-density mode a downsampled selection keeping the shape"""
+    if not high_density:
+        return df
+    return downsample_frame(df, 'Date', y_column, HIGH_DENSITY_POINTS)
+
+def instrument_date_range(partitions, instrument):
+    """First and last date plotted for an instrument over all its peptides, or None without data"""
+    dates = [rows['Date'] for (name, _), rows in partitions.items() if name == instrument]
+    if not dates:
+        return None
+    return min(d.min() for d in dates), max(d.max() for d in dates)
+
+def plot_masserrorppm(df, title, high_density=False):
+    fig = go.Figure()
+
+    # Plot alle punkter undtagen det sidste
+    df_previous = chart_rows(df.iloc[:-1], 'Masserrorppm', high_density)
+    fig.add_trace(scatter_type(high_density)(
+        x=df_previous['Date'], 
+        y=df_previous['Masserrorppm'], 
+        mode='markers', 
+        name='Previous Data', 
+        marker=dict(color='blue'),
+        hovertemplate='<b>Previous Data</b><br>' +
+                      'Date: %{x}<br>' +
+                      'Mass error (ppm): %{y:.2f}<br>' +
+                      '<extra></extra>'
+    ))
+
+    # Plot det sidste punkt i rødt
+    last_point = df.iloc[-1]
+    fig.add_trace(scatter_type(high_density)(
+        x=[last_point['Date']], 
+        y=[last_point['Masserrorppm']], 
+        mode='markers', 
+        name='Latest Data Point', 
+        marker=dict(color='red', size=10),
+        hovertemplate='<b>Latest Data Point</b><br>' +
+                      'Date: %{x}<br>' +
+                      'Mass error (ppm): %{y:.2f}<br>' +
+                      '<extra></extra>'
+    ))
+
+    # Formatering af akser
+    fig.update_layout(
+        title=title, 
+        xaxis_title='Date', 
+        yaxis_title='Masserrorppm',
+        xaxis=dict(
+            tickformat='%Y-%m-%d',  # Kun dato
+            type='date'
+        )
+    )
+    return fig
+
+def rollup_customdata(df, metric):
+    """Aggregates shown on hover when a chart plots rollup means; None for raw rows"""
+    if 'Count' not in df.columns:
+        return None
+    return df[['Count', f'{metric}Min', f'{metric}Max', 'OutOfLimit']]
+
+def rollup_hovertemplate(df, value_format, show_out_of_limit=False):
+    if 'Count' not in df.columns:
+        return ''
+    template = ('Mean of %{customdata[0]} measurements<br>' +
+                f'Range: %{{customdata[1]:{value_format}}} to %{{customdata[2]:{value_format}}}<br>')
+    if show_out_of_limit:
+        template += 'Outside ±10 ppm: %{customdata[3]}<br>'
+    return template
+
+def rollup_error_bars(df, metric, mean_column):
+    """Bars from the minimum to the maximum of each bucket around the plotted mean"""
+    if 'Count' not in df.columns:
+        return None
+    return dict(
+        type='data', symmetric=False, thickness=1, width=0,
+        array=df[f'{metric}Max'] - df[mean_column],
+        arrayminus=df[mean_column] - df[f'{metric}Min']
+    )
+
+def peptide_trace(df_peptide, peptide, metric, high_density=False):
+    """One peptide's 'Masserrorppm' or 'Response' over time, as a line in the peptide's colour"""
+    df_peptide = chart_rows(df_peptide, metric, high_density)
+    if metric == 'Masserrorppm':
+        rollup_metric = 'Masserror'
+        value_hover = 'Mass error (ppm): %{y:.2f}<br>' + rollup_hovertemplate(df_peptide, '.2f', show_out_of_limit=True)
+    else:
+        rollup_metric = 'Response'
+        value_hover = 'Response: %{y:,.0f}<br>' + rollup_hovertemplate(df_peptide, ',.0f')
+    return scatter_type(high_density)(
+        x=df_peptide['Date'], 
+        y=df_peptide[metric], 
+        mode='lines+markers', 
+        name=peptide,
+        line=dict(color=PEPTIDE_COLORS[peptide]),
+        marker=dict(color=PEPTIDE_COLORS[peptide]),
+        error_y=rollup_error_bars(df_peptide, rollup_metric, metric),
+        customdata=rollup_customdata(df_peptide, rollup_metric),
+        hovertemplate='<b>%{fullData.name}</b><br>' +
+                      'Date: %{x}<br>' +
+                      value_hover +
+                      '<extra></extra>'  # Fjerner default hover box
+    )
+
+def plot_mass_error_combined(partitions, instrument, title, time_period="All", high_density=False):
+    """Kombineret Mass Error plot for alle peptider på ét instrument"""
+    fig = go.Figure()
+
+    # Datoerne fra faktisk plottede data (kun for "Data range")
+    plotted_range = instrument_date_range(
+        {key: rows for key, rows in partitions.items() if key[1] in CANONICAL_PEPTIDES}, instrument
+    ) if time_period == "Data range" else None
+
+    # Tilføj alle peptider til samme plot
+    for peptide in CANONICAL_PEPTIDES:
+        df_peptide = partitions.get((instrument, peptide))
+        if df_peptide is not None:  # Kun tilføj hvis der er data
+            fig.add_trace(peptide_trace(df_peptide, peptide, 'Masserrorppm', high_density))
+
+    # Tilføj røde linjer ved ±10 ppm
+    # For "Data range" brug plottet data range, for andre tidsperioder hele instrumentets range (som før)
+    limit_range = plotted_range if time_period == "Data range" else instrument_date_range(partitions, instrument)
+    if limit_range is not None:
+        min_limit_date, max_limit_date = limit_range
+        fig.add_shape(type="line", 
+                     x0=min_limit_date, x1=max_limit_date, 
+                     y0=10, y1=10, 
+                     line=dict(color="red", width=2, dash="dash"),
+                     name="+10 ppm limit")
+        fig.add_shape(type="line", 
+                     x0=min_limit_date, x1=max_limit_date, 
+                     y0=-10, y1=-10, 
+                     line=dict(color="red", width=2, dash="dash"),
+                     name="-10 ppm limit")
+
+    # Formatering af akser
+    xaxis_config = {
+        'tickformat': '%Y-%m-%d',  # Kun dato
+        'type': 'date'
+    }
+
+    # Kun for "Data range" sæt x-aksen til faktisk plottede data
+    if plotted_range is not None:
+        xaxis_config['range'] = list(plotted_range)
+    # For alle andre tidsperioder: normal auto-range (som før)
+
+    fig.update_layout(
+        title=title, 
+        xaxis_title='Date', 
+        yaxis_title='Mass Error (ppm)',
+        xaxis=xaxis_config,
+        yaxis=dict(
+            tickformat='.2f'
+        ),
+        height=400
+    )
+    return fig
+
+def plot_single_peptide(partitions, instrument, peptide_name, title, high_density=False):
+    """Plot for en enkelt peptid på ét instrument"""
+    fig = go.Figure()
+
+    df_peptide = partitions.get((instrument, peptide_name))
+
+    if df_peptide is not None:
+        df_peptide = chart_rows(df_peptide, 'Response', high_density)
+        fig.add_trace(scatter_type(high_density)(
+            x=df_peptide['Date'], 
+            y=df_peptide['Response'], 
+            mode='lines+markers', 
+            name=peptide_name,
+            line=dict(color=PEPTIDE_COLORS.get(peptide_name, 'rgb(128, 128, 128)')),
+            marker=dict(color=PEPTIDE_COLORS.get(peptide_name, 'rgb(128, 128, 128)')),
+            hovertemplate='<b>%{fullData.name}</b><br>' +
+                          'Date: %{x}<br>' +
+                          'Response: %{y:,.0f}<br>' +
+                          '<extra></extra>'  # Fjerner default hover box
+        ))
+
+    # Formatering af akser
+    fig.update_layout(
+        title=title, 
+        xaxis_title='Date', 
+        yaxis_title='Response',
+        xaxis=dict(
+            tickformat='%Y-%m-%d',  # Kun dato
+            type='date'
+        ),
+        yaxis=dict(
+            tickformat='.2s',  # Smart formatering
+            separatethousands=True
+        )
+    )
+    return fig
+
+def plot_response(partitions, instrument, title, time_period="All", high_density=False):
+    fig = go.Figure()
+
+    # Datoerne fra faktisk plottede data (kun for "Data range")
+    plotted_range = instrument_date_range(
+        {key: rows for key, rows in partitions.items() if key[1] in CANONICAL_PEPTIDES}, instrument
+    ) if time_period == "Data range" else None
+
+    # Tilføj alle peptider til samme plot
+    for peptide in CANONICAL_PEPTIDES:
+        df_peptide = partitions.get((instrument, peptide))
+        if df_peptide is not None:  # Kun tilføj hvis der er data
+            fig.add_trace(peptide_trace(df_peptide, peptide, 'Response', high_density))
+
+    # Formatering af akser
+    xaxis_config = {
+        'tickformat': '%Y-%m-%d',  # Kun dato, ikke tidspunkt
+        'type': 'date'
+    }
+
+    # Kun for "Data range" sæt x-aksen til faktisk plottede data
+    if plotted_range is not None:
+        xaxis_config['range'] = list(plotted_range)
+    # For alle andre tidsperioder: normal auto-range (som før)
+
+    fig.update_layout(
+        title=title, 
+        xaxis_title='Date', 
+        yaxis_title='Response',
+        xaxis=xaxis_config,
+        yaxis=dict(
+            tickformat='.2s',  # Maksimalt 2 decimaler, smart formatering
+            separatethousands=True  # Tusindtalsseparatorer
+        )
+    )
+    return fig
+
+def plot_dashboard(partitions, time_period="All", high_density=False):
+    """Mass error and response for both instruments in one figure; the panels share and link their date axis"""
+    fig = make_subplots(
+        rows=2, cols=len(CHART_INSTRUMENTS),
+        shared_xaxes='all',
+        vertical_spacing=0.08,
+        subplot_titles=[f"{instrument} - {metric}" for metric in ("Mass Error", "MS Response")
+                        for instrument in CHART_INSTRUMENTS]
+    )
+
+    # Hver peptid vises én gang i legenden; et klik skjuler den i alle paneler
+    in_legend = set()
+    for col, instrument in enumerate(CHART_INSTRUMENTS, start=1):
+        for peptide in CANONICAL_PEPTIDES:
+            df_peptide = partitions.get((instrument, peptide))
+            if df_peptide is None:
+                continue
+            for row, metric in ((1, 'Masserrorppm'), (2, 'Response')):
+                trace = peptide_trace(df_peptide, peptide, metric, high_density)
+                trace.update(legendgroup=peptide, showlegend=peptide not in in_legend)
+                in_legend.add(peptide)
+                fig.add_trace(trace, row=row, col=col)
+
+        # Røde linjer ved ±10 ppm over hele panelets bredde
+        for limit in (10, -10):
+            fig.add_hline(y=limit, line=dict(color="red", width=2, dash="dash"), row=1, col=col)
+
+    # Kun for "Data range" sæt x-aksen til faktisk plottede data, for begge instrumenter
+    if time_period == "Data range":
+        plotted = {key: rows for key, rows in partitions.items() if key[1] in CANONICAL_PEPTIDES}
+        ranges = [instrument_date_range(plotted, instrument) for instrument in CHART_INSTRUMENTS]
+        ranges = [date_range for date_range in ranges if date_range is not None]
+        if ranges:
+            fig.update_xaxes(range=[min(start for start, _ in ranges), max(end for _, end in ranges)])
+
+    fig.update_xaxes(tickformat='%Y-%m-%d', type='date')
+    fig.update_xaxes(title_text='Date', row=2)
+    fig.update_yaxes(title_text='Mass Error (ppm)', tickformat='.2f', row=1, col=1)
+    fig.update_yaxes(tickformat='.2f', row=1)
+    fig.update_yaxes(title_text='Response', row=2, col=1)
+    fig.update_yaxes(tickformat='.2s', separatethousands=True, row=2)
+    fig.update_layout(height=800)
+    return fig
@@ -0,0 +1,382 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from io import StringIO
+
+def validate_standardized_rows(df_standardized):
+    """
+    Columnar content check of a standardized CSV frame.
+    Returns the frame with numeric 'response' and 'mass_error' columns, and a list of
+    "Row N: ..." error messages (empty when every row is valid).
+    """
+    index = df_standardized.index
+    checks = []  # (mask of failing rows, message per row) in the order they are reported
+    
+    # Check for empty required fields
+    for field, message in (('sample_id', "Missing Sample ID"), ('peptide', "Missing Peptide name")):
+        column = df_standardized[field]
+        missing = column.isna() | (column.astype(str).str.strip() == "")
+        checks.append((missing, pd.Series(message, index=index)))
+    
+    # Validate numeric fields - comma is accepted as decimal separator
+    numeric_columns = {}
+    for field, label in (('response', "Response"), ('mass_error', "Mass error")):
+        column = df_standardized[field]
+        text = column.astype(str)
+        missing = column.isna() | (text.str.strip() == "")
+        if pd.api.types.is_numeric_dtype(column):
+            values = column.astype(float)
+            both_separators = pd.Series(False, index=index)
+        else:
+            values = pd.to_numeric(text.str.replace(',', '.', regex=False).str.strip(), errors='coerce')
+            both_separators = (
+                text.str.contains(',', regex=False) & text.str.contains('.', regex=False) & values.notna()
+            )
+        numeric_columns[field] = values
+        checks.append((missing, pd.Series(f"Missing {label}", index=index)))
+        checks.append((both_separators, pd.Series(f"{label} has both comma and decimal point", index=index)))
+        checks.append((values.isna() & ~missing, f"Invalid {label} value: '" + text + "'"))
+        # "inf" and "1e999" parse as numbers, but cannot be rounded or stored as measurements
+        checks.append((values.isin([np.inf, -np.inf]), f"{label} must be a finite number: '" + text + "'"))
+    
+    # Only failing rows are visited to build their messages
+    failing = pd.concat([mask for mask, _ in checks], axis=1).any(axis=1)
+    validation_errors = []
+    for row_index in index[failing.to_numpy()]:
+        row_errors = [message.at[row_index] for mask, message in checks if mask.at[row_index]]
+        validation_errors.append(f"Row {row_index+1}: {'; '.join(row_errors)}")
+    
+    df_typed = df_standardized.assign(**numeric_columns)
+    return df_typed, validation_errors
+
+def build_insert_rows(df_validated, fallback_instrument, comments):
+    """Build the insert dicts for submit_insert_job(), insert_batch() and insert_rows() from a validated frame, column by column"""
+    index = df_validated.index
+    
+    # Determine instrument: use Item description if available, otherwise use selected instrument
+    instruments = pd.Series(fallback_instrument, index=index, dtype=object)
+    if 'item_description' in df_validated.columns:
+        item_desc = df_validated['item_description'].astype(str).str.lower()
+        instruments = instruments.mask(item_desc.str.contains('luke', regex=False), "Luke")
+        instruments = instruments.mask(item_desc.str.contains('leia', regex=False), "Leia")
+    # Rows without an instrument get None, not NaN, so callers can find them and the database stores NULL
+    instruments = instruments.astype(object).where(instruments.notna(), None)
+    
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    dates = pd.Series(now, index=index)
+    if 'acquisition_date' in df_validated.columns:
+        acquisition = df_validated['acquisition_date']
+        has_date = acquisition.notna() & (acquisition.astype(str).str.strip() != "")
+        dates = acquisition.astype(str).where(has_date, now)
+    
+    # Round Response to nearest integer (no decimals)
+    responses = df_validated['response'].round().astype('int64')
+    
+    return [
+        {
+            "Date": date_value,
+            "Response": response_value,
+            "Masserrorppm": mass_error,
+            "Peptide": peptide,
+            "Samplename": sample_id,
+            "Instrument": instrument,
+            "Kommentar": comment
+        }
+        for date_value, response_value, mass_error, peptide, sample_id, instrument, comment in zip(
+            dates.tolist(),
+            responses.tolist(),
+            df_validated['mass_error'].tolist(),
+            df_validated['peptide'].tolist(),
+            df_validated['sample_id'].tolist(),
+            instruments.tolist(),
+            comments
+        )
+    ]
+
+# Largest file validate_csv_format() parses in one piece; bigger exports must be streamed in chunks
+MAX_CSV_BYTES = 100 * 1024 * 1024
+
+# Registry of supported export layouts, tried in registration order
+CSV_FORMATS = []
+
+def register_csv_format(name, detect, prepare, standardize):
+    """
+    Register an export layout.
+    detect(header) gets only the column names and returns True for files in this layout.
+    prepare(header, manual_mapping) returns (plan, column_info): plan['columns'] maps each column to
+    read to its dtype (str or None), and plan is None while columns still need manual mapping.
+    standardize(df_raw, plan, allow_empty) returns (df, errors, warnings) with the standard
+    columns sample_id, peptide, component, response and mass_error.
+    """
+    CSV_FORMATS.append({'name': name, 'detect': detect, 'prepare': prepare, 'standardize': standardize})
+
+def normalize_column_name(name):
+    return str(name).strip().lower()
+
+def build_alias_index(patterns):
+    """Compile {normalized alias: [(field, preference)]} so a header is mapped in one pass over its columns"""
+    alias_index = {}
+    for field, aliases in patterns.items():
+        for preference, alias in enumerate(aliases):
+            alias_index.setdefault(normalize_column_name(alias), []).append((field, preference))
+    return alias_index
+
+def map_columns(header, alias_index):
+    """Return {field: column}, using the most preferred alias found in the header for each field"""
+    best = {}
+    for column in header:
+        for field, preference in alias_index.get(normalize_column_name(column), ()):
+            if field not in best or preference < best[field][0]:
+                best[field] = (preference, column)
+    return {field: column for field, (_, column) in best.items()}
+
+def find_acquisition_column(header):
+    return next((col for col in header if normalize_column_name(col) == "acquisition started date"), None)
+
+# New Component format
+COMPONENT_COLUMNS = {'Component': str, 'Mass error': None, 'MS response': None, 'Item description': str}
+
+def standardize_component_format(df_raw, plan, allow_empty):
+    errors = []
+    df_valid = df_raw[df_raw['Component'].notna() & (df_raw['Component'] != "")]
+
+    if len(df_valid) == 0 and not allow_empty:
+        errors.append("No rows with valid Component found in the data")
+        return None, errors, []
+
+    # Map the new Component format columns to our expected format
+    try:
+        # Create standardized DataFrame for Component format
+        standardized_data = {
+            'sample_id': df_valid['Component'].astype(str) + "_" + datetime.now().strftime("%Y%m%d"),
+            'peptide': df_valid['Component'].astype(str),    # Use Component as peptide name
+            'component': df_valid['Component'].astype(str),  # Same as peptide for this format
+            'response': df_valid['MS response'],
+            'mass_error': df_valid['Mass error'],
+            'item_description': df_valid['Item description']  # For instrument detection
+        }
+        return pd.DataFrame(standardized_data), errors, []
+    except KeyError as e:
+        errors.append(f"Missing expected column in Component format: {str(e)}")
+        return None, errors, []
+
+register_csv_format(
+    "Component",
+    detect=lambda header: set(COMPONENT_COLUMNS) <= set(header),
+    prepare=lambda header, manual_mapping: ({'columns': COMPONENT_COLUMNS}, None),
+    standardize=standardize_component_format
+)
+
+# New Intact Mass format - rows with a Molecule ID are used, the Molecule ID is the peptide name
+INTACT_MASS_COLUMNS = {'Molecule ID': str, 'Component': str, 'Response': None, 'Mass error (ppm)': None}
+
+def standardize_intact_mass_format(df_raw, plan, allow_empty):
+    errors = []
+    # Filter to only rows with non-empty Molecule ID (instead of just Product rows)
+    df_valid = df_raw[df_raw['Molecule ID'].notna() & (df_raw['Molecule ID'] != "")]
+
+    if len(df_valid) == 0 and not allow_empty:
+        errors.append("No rows with valid Molecule ID found in the data")
+        return None, errors, []
+
+    try:
+        # Use Molecule ID as peptide name (e.g., "Apomyoglobin")
+        standardized_data = {
+            'sample_id': df_valid['Molecule ID'].astype(str) + "_" + datetime.now().strftime("%Y%m%d"),
+            'peptide': df_valid['Molecule ID'].astype(str),    # Use Molecule ID as peptide name
+            'component': df_valid['Component'].astype(str),    # Use Component column if available
+            'response': df_valid['Response'],
+            'mass_error': df_valid['Mass error (ppm)']
+        }
+        return pd.DataFrame(standardized_data), errors, []
+    except KeyError as e:
+        errors.append(f"Missing expected column in new format: {str(e)}")
+        return None, errors, []
+
+register_csv_format(
+    "Intact Mass",
+    detect=lambda header: 'Type' in header and 'Molecule ID' in header,
+    prepare=lambda header, manual_mapping: ({'columns': INTACT_MASS_COLUMNS}, None),
+    standardize=standardize_intact_mass_format
+)
+
+# Original Unifi format - expected column patterns (multiple variations supported), in order of preference
+UNIFI_COLUMN_PATTERNS = {
+    'sample_id': ['Item Name CC', 'item name cc', 'sample id', 'sampleid', 'sample name', 'item_name_cc'],
+    'peptide': ['Description CC', 'description cc', 'peptide', 'component name', 'compound', 'description_cc'],
+    'component': ['Component name', 'component name', 'component_name', 'component'],
+    'response': ['Response', 'response', 'intensity', 'peak area', 'area'],
+    'mass_error': ['Mass error (ppm)', 'mass error', 'mass_error_ppm', 'mass error ppm', 'ppm', 'mass_error']
+}
+UNIFI_ALIAS_INDEX = build_alias_index(UNIFI_COLUMN_PATTERNS)
+UNIFI_TEXT_FIELDS = ('sample_id', 'peptide', 'component')
+
+def prepare_unifi_format(header, manual_mapping):
+    column_mapping = map_columns(header, UNIFI_ALIAS_INDEX)
+    missing_fields = [field for field in UNIFI_COLUMN_PATTERNS if field not in column_mapping]
+    column_info = {'columns': list(header), 'missing_fields': missing_fields}
+
+    # If we have missing fields, use the manual mapping chosen by the user
+    if missing_fields:
+        selected_mapping = {
+            field: column for field, column in manual_mapping.items()
+            if field in missing_fields and column in header
+        }
+        column_mapping.update(selected_mapping)
+
+        # Check if all fields are now mapped
+        if any(field not in selected_mapping for field in missing_fields):
+            return None, column_info
+
+    columns = {}
+    for field, column in column_mapping.items():
+        columns[column] = str if field in UNIFI_TEXT_FIELDS else None
+    return {'columns': columns, 'mapping': column_mapping}, column_info
+
+def standardize_unifi_format(df_raw, plan, allow_empty):
+    errors = []
+    warnings = []
+    column_mapping = plan['mapping']
+
+    # Create standardized DataFrame with mapped columns
+    try:
+        standardized_data = {}
+        required_fields = ['sample_id', 'peptide', 'response', 'mass_error']
+
+        for field in required_fields:
+            if field in column_mapping:
+                standardized_data[field] = df_raw[column_mapping[field]]
+            else:
+                errors.append(f"Required field '{field}' is not mapped")
+                return None, errors, warnings
+
+        # Add component field if available, otherwise use peptide
+        if 'component' in column_mapping:
+            standardized_data['component'] = df_raw[column_mapping['component']]
+        else:
+            standardized_data['component'] = standardized_data['peptide']
+            warnings.append("Component column not found, using Peptide column instead")
+
+        return pd.DataFrame(standardized_data), errors, warnings
+    except Exception as e:
+        errors.append(f"Error creating standardized data: {str(e)}")
+        return None, errors, warnings
+
+# Registered last: any other header is treated as the original format and mapped by column aliases
+register_csv_format(
+    "Unifi",
+    detect=lambda header: True,
+    prepare=prepare_unifi_format,
+    standardize=standardize_unifi_format
+)
+
+def plan_csv_read(header, manual_mapping=None):
+    """
+    Pick the registered layout for a CSV header and work out which columns to read.
+    Returns (csv_format, plan, column_info); csv_format is None for unrecognized headers and
+    plan is None while columns still need manual mapping.
+    """
+    csv_format = next((fmt for fmt in CSV_FORMATS if fmt['detect'](header)), None)
+    if csv_format is None:
+        return None, None, None
+    plan, column_info = csv_format['prepare'](header, manual_mapping or {})
+    return csv_format, plan, column_info
+
+def csv_read_options(header, plan):
+    """usecols and dtype arguments for a column-projected pd.read_csv of a planned file"""
+    acquisition_col = find_acquisition_column(header)
+    usecols = [col for col in header if col in plan['columns'] or col == acquisition_col]
+    dtype = {col: plan['columns'][col] for col in usecols if plan['columns'].get(col) is str}
+    return {'usecols': usecols, 'dtype': dtype}
+
+def read_csv_header(file_obj):
+    """Column names of a CSV file, reading only its first line"""
+    return list(pd.read_csv(file_obj, nrows=0).columns)
+
+def validate_csv_format(data_input, manual_mapping=None):
+    """
+    Comprehensive CSV validation with detailed error reporting and field mapping
+    The layout is detected from the header alone, then only the columns it needs are parsed.
+    For the original format, manual_mapping maps unmatched fields to CSV columns, and
+    column_info ({'columns', 'missing_fields'}) tells the caller which fields need mapping
+    """
+    if len(data_input) > MAX_CSV_BYTES:
+        size_mb = MAX_CSV_BYTES // (1024 * 1024)
+        return None, [f"File is larger than {size_mb} MB - use streaming ingestion instead"], [], None
+
+    try:
+        header = read_csv_header(StringIO(data_input))
+        csv_format, plan, column_info = plan_csv_read(header, manual_mapping)
+        if csv_format is None:
+            return None, ["Unrecognized CSV layout"], [], None
+        if plan is None:
+            # Columns still need manual mapping - the body is not parsed until they are mapped
+            return None, [], [], column_info
+
+        df_raw = pd.read_csv(StringIO(data_input), **csv_read_options(header, plan))
+    except Exception as e:
+        return None, [f"Error parsing CSV: {str(e)}"], [], None
+
+    df, errors, warnings = standardize_csv_frame(df_raw, csv_format, plan)
+    return df, errors, warnings, column_info
+
+def standardize_csv_frame(df_raw, csv_format, plan, allow_empty=False):
+    """
+    Map a parsed CSV frame (or chunk of one) in the given layout to the standard columns and
+    validate the content. Returns (df, errors, warnings).
+    allow_empty accepts frames without valid rows, for chunks of a streamed file.
+    """
+    try:
+        df_standardized, errors, warnings = csv_format['standardize'](df_raw, plan, allow_empty)
+        if df_standardized is None:
+            return None, errors, warnings
+
+        # Formatted acquisition dates, aligned with the rows kept by the layout
+        acquisition_col = find_acquisition_column(df_raw.columns)
+        if acquisition_col is not None:
+            parsed = pd.to_datetime(df_raw.loc[df_standardized.index, acquisition_col], errors='coerce')
+            df_standardized['acquisition_date'] = parsed.dt.strftime('%Y-%m-%d').where(~parsed.isna(), None)
+
+        # Validate data content for all formats
+        df_standardized, validation_errors = validate_standardized_rows(df_standardized)
+
+        if validation_errors:
+            errors.extend(validation_errors)
+            return None, errors, warnings
+
+        return df_standardized, errors, warnings
+
+    except Exception as e:
+        return None, [f"Error parsing CSV: {str(e)}"], []
+
+def detect_instrument_from_filename(filename):
+    """Return "Leia" or "Luke" when the instrument name is part of the filename, otherwise None"""
+    name = filename.lower()
+    if "leia" in name:
+        return "Leia"
+    if "luke" in name:
+        return "Luke"
+    return None
+
+def validate_csv_file(filename, content, manual_mapping=None):
+    """
+    Decode, validate and detect the instrument of one uploaded CSV file.
+    Only uses pandas, so it can run in a worker process for batch uploads.
+    """
+    result = {
+        'filename': filename,
+        'instrument': detect_instrument_from_filename(filename),
+        'df': None,
+        'errors': [],
+        'warnings': [],
+        'column_info': None
+    }
+    try:
+        data_input = content.decode('utf-8')
+    except UnicodeDecodeError as e:
+        result['errors'] = [f"Error decoding CSV: {str(e)}"]
+        return result
+
+    df, errors, warnings, column_info = validate_csv_format(data_input, manual_mapping)
+    result.update({'df': df, 'errors': errors, 'warnings': warnings, 'column_info': column_info})
+    return result
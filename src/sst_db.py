@@ -0,0 +1,645 @@
+import atexit
+import contextlib
+import functools
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+from sst_metrics import increment, timed
+
+load_dotenv()
+
+# Database connection parameters
+conn_params = {
+    'dbname': os.getenv('DB_NAME'),
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'host': os.getenv('DB_HOST'),
+    'port': os.getenv('DB_PORT')
+}
+
+# Connection pool size, and how long to wait for a free connection when all are in use
+POOL_MIN_CONNECTIONS = int(os.getenv('DB_POOL_MIN', 1))
+POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+
+# Connections idle for longer than this are checked with a ping before they are handed out
+POOL_PING_AFTER_SECONDS = 30
+
+# Incremented after every committed write, so cached reads can be keyed on it
+data_version = 0
+data_version_lock = threading.Lock()
+
+# Process-wide pool shared by every session, created on first use
+pool = None
+pool_lock = threading.Lock()
+pool_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+last_used = {}  # id(connection) -> time it was returned to the pool
+
+def get_data_version():
+    return data_version
+
+def mark_data_changed():
+    """Call after committing a write to "Data"; invalidates reads cached under the old version"""
+    global data_version
+    with data_version_lock:
+        data_version += 1
+
+def get_pool():
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ThreadedConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, **conn_params)
+        return pool
+
+def is_healthy(conn):
+    """Health check on checkout: closed connections fail, long-idle ones must answer a ping"""
+    if conn.closed:
+        return False
+    if time.monotonic() - last_used.get(id(conn), 0) < POOL_PING_AFTER_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextlib.contextmanager
+def get_connection():
+    """
+    Borrow a connection from the process-wide pool. Any open transaction is rolled back when
+    the block ends, so callers commit their writes themselves. Waits up to POOL_TIMEOUT seconds
+    when every connection is in use.
+    """
+    if not pool_slots.acquire(timeout=POOL_TIMEOUT):
+        raise psycopg2.OperationalError(f"No database connection available after {POOL_TIMEOUT} seconds")
+    try:
+        connection_pool = get_pool()
+        conn = connection_pool.getconn()
+        # Discard dead connections, e.g. after a database restart; new ones are opened as needed
+        for _ in range(POOL_MAX_CONNECTIONS):
+            if is_healthy(conn):
+                break
+            last_used.pop(id(conn), None)
+            connection_pool.putconn(conn, close=True)
+            conn = connection_pool.getconn()
+
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            try:
+                if not conn.closed and not broken:
+                    conn.rollback()
+                    last_used[id(conn)] = time.monotonic()
+            except psycopg2.Error:
+                # The connection died since the block ended; it is closed instead of returned
+                broken = True
+            finally:
+                if broken or conn.closed:
+                    last_used.pop(id(conn), None)
+                connection_pool.putconn(conn, close=broken or bool(conn.closed))
+    finally:
+        pool_slots.release()
+
+@atexit.register
+def close_pool():
+    """Close every pooled connection; registered to run when the process exits"""
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.closeall()
+            pool = None
+
+# Canonical spellings of the known peptides and instruments; other names are stored as they are, trimmed
+CANONICAL_PEPTIDES = ("Apomyoglobin", "Digest1", "Digest2", "Digest3")
+CANONICAL_INSTRUMENTS = ("Luke", "Leia")
+
+def normalize_name(value, canonical):
+    """
+    Peptide or instrument name as it is stored: trimmed, without a trailing "_" (exports write "Digest1_"
+    for "Digest1"), and spelled as in canonical when it matches one of those names ignoring case.
+    """
+    if value is None:
+        return None
+    name = str(value).strip()
+    if name.endswith("_"):
+        name = name[:-1]
+    return {known.lower(): known for known in canonical}.get(name.lower(), name)
+
+def normalize_name_sql(column, canonical):
+    """SQL expression doing what normalize_name() does to a stored column"""
+    name = f"regexp_replace(btrim({column}), '_$', '')"
+    cases = " ".join(f"WHEN '{known.lower()}' THEN '{known}'" for known in canonical)
+    return f"CASE lower({name}) {cases} ELSE {name} END"
+
+def fingerprint_sql(date, response, mass_error, peptide, samplename, instrument, kommentar):
+    """SQL expression hashing the duplicate-check columns into one "Fingerprint" value"""
+    parts = " || '|' || ".join(
+        f"coalesce({column}, '')"
+        for column in (date, response, mass_error, peptide, samplename, instrument, kommentar)
+    )
+    return f"md5({parts})"
+
+def date_key_sql(date):
+    """Dates in the fingerprint are compared as local date and time, so '2025-01-01' matches a stored midnight"""
+    return f"to_char(({date})::timestamp, 'YYYY-MM-DD HH24:MI:SS')"
+
+# Fingerprint of a stored row, used for the backfill
+STORED_FINGERPRINT = fingerprint_sql(
+    date_key_sql('"Date"'), '"Response"::text', '"Masserrorppm"::text', '"Peptide"', '"Samplename"', '"Instrument"', '"Kommentar"'
+)
+
+def backfill_fingerprints(cursor):
+    """Fingerprint rows that have none; older duplicates keep a NULL fingerprint so no data is removed"""
+    cursor.execute(f"""
+    UPDATE "Data" d SET "Fingerprint" = f.fingerprint
+    FROM (
+        SELECT "ID", fingerprint, row_number() OVER (PARTITION BY fingerprint ORDER BY "ID") AS occurrence
+        FROM (SELECT "ID", {STORED_FINGERPRINT} AS fingerprint FROM "Data" WHERE "Fingerprint" IS NULL) unhashed
+    ) f
+    WHERE d."ID" = f."ID"
+    AND f.occurrence = 1
+    AND NOT EXISTS (SELECT 1 FROM "Data" e WHERE e."Fingerprint" = f.fingerprint)
+    """)
+
+def migrate_fingerprint_column(cursor):
+    cursor.execute('ALTER TABLE "Data" ADD COLUMN IF NOT EXISTS "Fingerprint" text')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS "Data_Fingerprint_key" ON "Data" ("Fingerprint")')
+
+def migrate_date_to_timestamptz(cursor):
+    # Every stored date must be readable before the column changes type; empty strings become NULL
+    cursor.execute("""
+    CREATE FUNCTION pg_temp.try_timestamptz(value text) RETURNS timestamptz AS $$
+    BEGIN
+        RETURN value::timestamptz;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("""
+    SELECT "ID", "Date"::text FROM "Data"
+    WHERE btrim("Date"::text) <> '' AND pg_temp.try_timestamptz("Date"::text) IS NULL
+    ORDER BY "ID" LIMIT 20
+    """)
+    unreadable = cursor.fetchall()
+    if unreadable:
+        rows = ", ".join(f"ID {id_number}: '{date}'" for id_number, date in unreadable)
+        raise ValueError(f"Dates that cannot be converted, correct them and run the migration again: {rows}")
+
+    cursor.execute("""
+    ALTER TABLE "Data" ALTER COLUMN "Date" TYPE timestamptz
+    USING NULLIF(btrim("Date"::text), '')::timestamptz
+    """)
+    # Fingerprints now hash the converted dates
+    cursor.execute('UPDATE "Data" SET "Fingerprint" = NULL')
+    backfill_fingerprints(cursor)
+
+def migrate_date_indexes(cursor):
+    # Peptide names are compared trimmed, so the index is on the trimmed name
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS "Data_Instrument_Peptide_Date_idx" ON "Data" ("Instrument", btrim("Peptide"), "Date")
+    """)
+    cursor.execute('CREATE INDEX IF NOT EXISTS "Data_Instrument_Date_idx" ON "Data" ("Instrument", "Date")')
+
+def migrate_table_index(cursor):
+    # The data table pages through rows in ("Date", "ID") order
+    cursor.execute('CREATE INDEX IF NOT EXISTS "Data_Date_ID_idx" ON "Data" ("Date", "ID")')
+
+# Mass errors outside ±MASS_ERROR_LIMIT_PPM are counted as out of limit in the rollups
+MASS_ERROR_LIMIT_PPM = 10
+
+# Advisory lock serializing rollup maintenance, so concurrent writers never store a stale aggregate
+ROLLUP_LOCK_ID = 0x5357_5352
+
+def rollup_select_sql(source, touched=None):
+    """Daily aggregates of the rows in source, optionally only for the (instrument, peptide, day) keys in touched"""
+    join = ""
+    if touched is not None:
+        join = f"""
+        JOIN {touched} t ON d."Instrument" = t.instrument AND d."Peptide" = t.peptide
+        AND d."Date" >= t.day AND d."Date" < t.day + 1"""
+    return f"""
+    SELECT d."Instrument", d."Peptide", d."Date"::date,
+        count(*), count(d."Masserrorppm"), sum(d."Masserrorppm"), min(d."Masserrorppm"), max(d."Masserrorppm"),
+        count(*) FILTER (WHERE abs(d."Masserrorppm") > {MASS_ERROR_LIMIT_PPM}),
+        count(d."Response"), sum(d."Response"), min(d."Response"), max(d."Response")
+    FROM {source} d{join}
+    WHERE d."Date" IS NOT NULL AND d."Instrument" IS NOT NULL AND d."Peptide" IS NOT NULL
+    GROUP BY 1, 2, 3
+    """
+
+# Keys of the rows changed by the statement that fired the rollup trigger
+ROLLUP_TOUCHED = """(
+    SELECT DISTINCT "Instrument" AS instrument, "Peptide" AS peptide, "Date"::date AS day
+    FROM changed_rows WHERE "Date" IS NOT NULL AND "Instrument" IS NOT NULL AND "Peptide" IS NOT NULL
+)"""
+
+def create_rollup_refresh(cursor):
+    # The days touched by a statement are recomputed from "Data"; the rest of the rollup is left alone.
+    # Names are stored normalized, so the stored columns are compared and the index on "Data" is used.
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION refresh_daily_rollup() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock({ROLLUP_LOCK_ID});
+        DELETE FROM "DailyRollup" r USING {ROLLUP_TOUCHED} t
+        WHERE r."Instrument" = t.instrument AND r."Peptide" = t.peptide AND r."Day" = t.day;
+        INSERT INTO "DailyRollup" {rollup_select_sql('"Data"', ROLLUP_TOUCHED)};
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+
+def migrate_daily_rollup(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS "DailyRollup" (
+        "Instrument" text NOT NULL,
+        "Peptide" text NOT NULL,
+        "Day" date NOT NULL,
+        "Count" integer NOT NULL,
+        "MasserrorCount" integer NOT NULL,
+        "MasserrorSum" numeric,
+        "MasserrorMin" numeric,
+        "MasserrorMax" numeric,
+        "OutOfLimit" integer NOT NULL,
+        "ResponseCount" integer NOT NULL,
+        "ResponseSum" numeric,
+        "ResponseMin" numeric,
+        "ResponseMax" numeric,
+        PRIMARY KEY ("Instrument", "Peptide", "Day")
+    )
+    """)
+    create_rollup_refresh(cursor)
+    # Transition tables have one name per trigger, so an update fires once for the old and once for the new rows
+    for name, event, transition in [
+        ("DailyRollup_insert", "INSERT", "NEW TABLE"),
+        ("DailyRollup_delete", "DELETE", "OLD TABLE"),
+        ("DailyRollup_update_old", "UPDATE", "OLD TABLE"),
+        ("DailyRollup_update_new", "UPDATE", "NEW TABLE"),
+    ]:
+        cursor.execute(f'DROP TRIGGER IF EXISTS "{name}" ON "Data"')
+        cursor.execute(f"""
+        CREATE TRIGGER "{name}" AFTER {event} ON "Data"
+        REFERENCING {transition} AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION refresh_daily_rollup()
+        """)
+    cursor.execute('TRUNCATE "DailyRollup"')
+    cursor.execute('INSERT INTO "DailyRollup" ' + rollup_select_sql('"Data"'))
+
+def migrate_normalize_names(cursor):
+    # Renamed rows are fingerprinted again, so rows that only differed by the spelling become duplicates
+    peptide = normalize_name_sql('"Peptide"', CANONICAL_PEPTIDES)
+    instrument = normalize_name_sql('"Instrument"', CANONICAL_INSTRUMENTS)
+    cursor.execute(f"""
+    UPDATE "Data" SET "Peptide" = {peptide}, "Instrument" = {instrument}, "Fingerprint" = NULL
+    WHERE "Peptide" IS DISTINCT FROM {peptide} OR "Instrument" IS DISTINCT FROM {instrument}
+    """)
+    backfill_fingerprints(cursor)
+    # Names are stored trimmed now, so the index no longer needs btrim()
+    cursor.execute('DROP INDEX IF EXISTS "Data_Instrument_Peptide_Date_idx"')
+    cursor.execute('CREATE INDEX "Data_Instrument_Peptide_Date_idx" ON "Data" ("Instrument", "Peptide", "Date")')
+
+def migrate_incremental_rollup(cursor):
+    # Inserted rows are added to their days from the transition table alone, so an insert never reads "Data".
+    # Sums of no values are NULL, hence the coalesce(); LEAST() and GREATEST() ignore NULLs.
+    # Deletes and updates cannot lower a minimum or maximum, so refresh_daily_rollup() still recomputes those.
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION add_daily_rollup() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock({ROLLUP_LOCK_ID});
+        INSERT INTO "DailyRollup" AS r {rollup_select_sql('changed_rows')}
+        ON CONFLICT ("Instrument", "Peptide", "Day") DO UPDATE SET
+            "Count" = r."Count" + EXCLUDED."Count",
+            "MasserrorCount" = r."MasserrorCount" + EXCLUDED."MasserrorCount",
+            "MasserrorSum" = coalesce(r."MasserrorSum" + EXCLUDED."MasserrorSum", r."MasserrorSum", EXCLUDED."MasserrorSum"),
+            "MasserrorMin" = LEAST(r."MasserrorMin", EXCLUDED."MasserrorMin"),
+            "MasserrorMax" = GREATEST(r."MasserrorMax", EXCLUDED."MasserrorMax"),
+            "OutOfLimit" = r."OutOfLimit" + EXCLUDED."OutOfLimit",
+            "ResponseCount" = r."ResponseCount" + EXCLUDED."ResponseCount",
+            "ResponseSum" = coalesce(r."ResponseSum" + EXCLUDED."ResponseSum", r."ResponseSum", EXCLUDED."ResponseSum"),
+            "ResponseMin" = LEAST(r."ResponseMin", EXCLUDED."ResponseMin"),
+            "ResponseMax" = GREATEST(r."ResponseMax", EXCLUDED."ResponseMax");
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    cursor.execute('DROP TRIGGER IF EXISTS "DailyRollup_insert" ON "Data"')
+    cursor.execute("""
+    CREATE TRIGGER "DailyRollup_insert" AFTER INSERT ON "Data"
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION add_daily_rollup()
+    """)
+
+# Schema changes in the order they are applied: (version, description, migration)
+SCHEMA_MIGRATIONS = [
+    (1, "Add row fingerprints for duplicate detection", migrate_fingerprint_column),
+    (2, "Store Date as timestamptz", migrate_date_to_timestamptz),
+    (3, "Index Instrument, Peptide and Date", migrate_date_indexes),
+    (4, "Index Date and ID for the data table", migrate_table_index),
+    (5, "Maintain daily rollups of mass error and response", migrate_daily_rollup),
+    (6, "Normalize peptide and instrument names", migrate_normalize_names),
+    (7, "Compare stored names in the rollup trigger", create_rollup_refresh),
+    (8, "Add inserted rows to the daily rollups incrementally", migrate_incremental_rollup),
+]
+
+# Advisory lock held while migrating, so concurrent app processes do not migrate at the same time
+SCHEMA_LOCK_ID = 0x5357_5354
+
+def get_applied_migrations(cursor):
+    """Versions recorded in "SchemaMigrations", creating the table on first use"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS "SchemaMigrations" (
+        "Version" integer PRIMARY KEY,
+        "Description" text NOT NULL,
+        "AppliedAt" timestamptz NOT NULL DEFAULT now()
+    )
+    """)
+    cursor.execute('SELECT "Version" FROM "SchemaMigrations"')
+    return {version for (version,) in cursor.fetchall()}
+
+def apply_migrations():
+    """
+    Apply pending SCHEMA_MIGRATIONS in one transaction; a failing migration leaves the schema unchanged.
+    Rows without a fingerprint are backfilled afterwards. Returns the (version, description) pairs that were applied.
+    """
+    applied = []
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+        done = get_applied_migrations(cursor)
+        for version, description, migrate in SCHEMA_MIGRATIONS:
+            if version in done:
+                continue
+            migrate(cursor)
+            cursor.execute('INSERT INTO "SchemaMigrations" ("Version", "Description") VALUES (%s, %s)', (version, description))
+            applied.append((version, description))
+        # Rows inserted by other tools have no fingerprint yet
+        backfill_fingerprints(cursor)
+        conn.commit()
+        cursor.close()
+    if applied:
+        mark_data_changed()
+    return applied
+
+@functools.lru_cache(maxsize=None)
+def ensure_schema():
+    """
+    Check before the first read or write that every migration has been applied. Runs once per process
+    once the check passes. Migrations rewrite the whole table, so they are not run from here;
+    a RuntimeError asks for migrate_db.py instead.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('\"SchemaMigrations\"') IS NOT NULL")
+        done = set()
+        if cursor.fetchone()[0]:
+            cursor.execute('SELECT "Version" FROM "SchemaMigrations"')
+            done = {version for (version,) in cursor.fetchall()}
+        cursor.close()
+    pending = [version for version, _, _ in SCHEMA_MIGRATIONS if version not in done]
+    if pending:
+        raise RuntimeError(f"The database schema is out of date (pending migrations: {', '.join(map(str, pending))}). "
+                           "Run python src/migrate_db.py to apply them.")
+    return True
+
+# Number of rows sent per statement by execute_values in the bulk insert path
+BULK_PAGE_SIZE = 1000
+
+def insert_rows(cursor, rows):
+    """
+    Insert rows with the given cursor without committing.
+    Peptide and instrument names are stored normalized, see normalize_name().
+    Duplicates are skipped by the unique "Fingerprint" index (ON CONFLICT DO NOTHING).
+    Returns one outcome per input row: "inserted" or "duplicate".
+    """
+    if not rows:
+        return []
+
+    values = [
+        (
+            index,
+            data["Date"],
+            str(data["Response"]),
+            str(data["Masserrorppm"]),
+            normalize_name(data["Peptide"], CANONICAL_PEPTIDES),
+            data["Samplename"],
+            normalize_name(data["Instrument"], CANONICAL_INSTRUMENTS),
+            data["Kommentar"]
+        )
+        for index, data in enumerate(rows)
+    ]
+    template = "(%s::int, %s::text, %s::text, %s::text, %s::text, %s::text, %s::text, %s::text)"
+
+    # The fingerprint is computed from the values as they will be stored, so it matches STORED_FINGERPRINT
+    values_fingerprint = fingerprint_sql(
+        date_key_sql('v.date'), 'v.response::numeric::text', 'v.masserror::numeric::text',
+        'v.peptide', 'v.samplename', 'v.instrument', 'v.kommentar'
+    )
+    insert_query = f"""
+    WITH v(idx, date, response, masserror, peptide, samplename, instrument, kommentar) AS (VALUES %s),
+    hashed AS (
+        SELECT v.*, {values_fingerprint} AS fingerprint FROM v
+    ),
+    inserted AS (
+        INSERT INTO "Data" ("Date", "Response", "Masserrorppm", "Peptide", "Samplename", "Instrument", "Kommentar", "Fingerprint")
+        SELECT date::timestamptz, response::numeric, masserror::numeric, peptide, samplename, instrument, kommentar, fingerprint
+        FROM hashed
+        ORDER BY idx
+        ON CONFLICT ("Fingerprint") DO NOTHING
+        RETURNING "Fingerprint"
+    )
+    SELECT min(hashed.idx) FROM hashed JOIN inserted ON inserted."Fingerprint" = hashed.fingerprint
+    GROUP BY hashed.fingerprint
+    """
+
+    # Rows not returned were skipped by the index, including repeats inside the batch
+    with timed("db_insert") as info:
+        inserted = execute_values(cursor, insert_query, values, template=template, page_size=BULK_PAGE_SIZE, fetch=True)
+        info['rows'] = len(rows)
+    increment('duplicates', "db_insert", len(rows) - len(inserted))
+    outcomes = ["duplicate"] * len(rows)
+    for (index,) in inserted:
+        outcomes[index] = "inserted"
+    return outcomes
+
+def insert_batch(rows, pending=None, progress=None):
+    """
+    Insert many rows over one connection in a single transaction.
+    Returns one outcome per input row: "inserted" or "duplicate". Database errors are raised.
+    pending, when given, receives the outcomes and the transaction ID just before the commit, so a caller
+    that loses the connection during the commit can ask transaction_committed() whether the rows were stored.
+    progress, when given, is called with the number of rows written so far after every BULK_PAGE_SIZE rows;
+    nothing is committed until all of them are written.
+    """
+    if not rows:
+        return []
+
+    ensure_schema()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        outcomes = []
+        step = len(rows) if progress is None else BULK_PAGE_SIZE
+        for start in range(0, len(rows), step):
+            outcomes.extend(insert_rows(cursor, rows[start:start + step]))
+            if progress is not None:
+                progress(len(outcomes))
+        if pending is not None:
+            cursor.execute("SELECT txid_current()")
+            pending.update(txid=cursor.fetchone()[0], outcomes=outcomes)
+        conn.commit()
+        cursor.close()
+    if "inserted" in outcomes:
+        mark_data_changed()
+    return outcomes
+
+def transaction_committed(txid):
+    """True when the transaction with this ID committed; see insert_batch()"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT txid_status(%s)", (txid,))
+        status = cursor.fetchone()[0]
+        cursor.close()
+    return status == "committed"
+
+def build_data_conditions(since=None, instruments=None, peptides=None):
+    """
+    WHERE conditions on "Data" for the selected rows.
+    since is a date string like '2025-01-31'; instruments and peptides are lists, None meaning all.
+    Returns (conditions, params).
+    """
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append('"Date" >= %s')
+        params.append(since)
+    if instruments is not None:
+        conditions.append('"Instrument" = ANY(%s)')
+        params.append(list(instruments))
+    if peptides is not None:
+        conditions.append('"Peptide" = ANY(%s)')
+        params.append(list(peptides))
+    return conditions, params
+
+def build_data_query(columns, since=None, instruments=None, peptides=None, after_id=None, ids=None):
+    """
+    Parameterized SELECT of the given columns from "Data", filtered in the database.
+    after_id limits it to rows added after that ID, ids to the listed rows.
+    Returns (query, params).
+    """
+    conditions, params = build_data_conditions(since, instruments, peptides)
+    if after_id is not None:
+        conditions.append('"ID" > %s')
+        params.append(int(after_id))
+    if ids is not None:
+        conditions.append('"ID" = ANY(%s)')
+        params.append([int(id_number) for id_number in ids])
+
+    query = f'SELECT {select_columns_sql(columns)} FROM "Data"'
+    if conditions:
+        query += ' WHERE ' + " AND ".join(conditions)
+    return query, params
+
+def select_columns_sql(columns):
+    # Dates are read as local date and time, like the values that were inserted
+    return ", ".join('"Date"::timestamp AS "Date"' if column == "Date" else f'"{column}"' for column in columns)
+
+# Columns searched by the data table's text filter
+SEARCH_COLUMNS = ("Instrument", "Peptide", "Samplename", "Kommentar")
+
+def build_table_page_query(columns, sort_column, descending, after, limit,
+                           since=None, instruments=None, peptides=None, search=None):
+    """
+    One page of the data table, sorted by (sort_column, "ID") with keyset pagination:
+    after is the (sort value, ID) of the last row on the previous page, or None for the first page.
+    Empty sort values count as the largest, which matches the order of a plain index on the column.
+    Returns (query, params).
+    """
+    conditions, params = build_data_conditions(since, instruments, peptides)
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        searched = ", ".join(f'"{column}"' for column in SEARCH_COLUMNS)
+        conditions.append(f"concat_ws(' ', {searched}) ILIKE %s")
+        params.append(f"%{escaped}%")
+
+    sort_sql = f'"{sort_column}"'
+    if after is not None:
+        value, last_id = after
+        if descending and value is None:
+            conditions.append(f'({sort_sql} IS NOT NULL OR "ID" < %s)')
+            params.append(last_id)
+        elif descending:
+            conditions.append(f'({sort_sql}, "ID") < (%s, %s)')
+            params.extend([value, last_id])
+        elif value is None:
+            conditions.append(f'({sort_sql} IS NULL AND "ID" > %s)')
+            params.append(last_id)
+        else:
+            conditions.append(f'(({sort_sql}, "ID") > (%s, %s) OR {sort_sql} IS NULL)')
+            params.extend([value, last_id])
+
+    direction = "DESC" if descending else "ASC"
+    query = f'SELECT {select_columns_sql(columns)} FROM "Data"'
+    if conditions:
+        query += ' WHERE ' + " AND ".join(conditions)
+    query += f' ORDER BY {sort_sql} {direction}, "ID" {direction} LIMIT %s'
+    params.append(int(limit))
+    return query, params
+
+def build_id_summary_query(max_id, since=None, instruments=None, peptides=None):
+    """
+    Count and sum of the IDs up to max_id among the selected rows. A loaded frame with the same
+    count and sum has had no rows deleted, and is not missing rows committed out of ID order.
+    Returns (query, params).
+    """
+    conditions, params = build_data_conditions(since, instruments, peptides)
+    conditions.append('"ID" <= %s')
+    params.append(int(max_id))
+    query = 'SELECT count(*), coalesce(sum("ID"), 0) FROM "Data" WHERE ' + " AND ".join(conditions)
+    return query, params
+
+# Rollup resolutions for the charts, as date_trunc() units
+ROLLUP_BUCKETS = ("day", "week", "month")
+
+def build_rollup_query(bucket, since=None, instruments=None, peptides=None):
+    """
+    Daily, weekly or monthly aggregates per instrument and peptide from "DailyRollup", with the mean in
+    "Masserrorppm" and "Response" so they plot like raw rows. Returns (query, params).
+    """
+    if bucket not in ROLLUP_BUCKETS:
+        raise ValueError(f"Unknown rollup bucket: {bucket}")
+    conditions = []
+    params = [bucket]
+    if since is not None:
+        conditions.append('"Day" >= %s')
+        params.append(since)
+    if instruments is not None:
+        conditions.append('"Instrument" = ANY(%s)')
+        params.append(list(instruments))
+    if peptides is not None:
+        conditions.append('"Peptide" = ANY(%s)')
+        params.append(list(peptides))
+
+    query = """
+    SELECT "Instrument", "Peptide", date_trunc(%s, "Day")::timestamp AS "Date",
+        sum("Count") AS "Count", sum("OutOfLimit") AS "OutOfLimit",
+        sum("MasserrorSum") / NULLIF(sum("MasserrorCount"), 0) AS "Masserrorppm",
+        min("MasserrorMin") AS "MasserrorMin", max("MasserrorMax") AS "MasserrorMax",
+        sum("ResponseSum") / NULLIF(sum("ResponseCount"), 0) AS "Response",
+        min("ResponseMin") AS "ResponseMin", max("ResponseMax") AS "ResponseMax"
+    FROM "DailyRollup"
+    """
+    if conditions:
+        query += ' WHERE ' + " AND ".join(conditions)
+    query += ' GROUP BY 1, 2, 3 ORDER BY 3'
+    return query, params
@@ -0,0 +1,87 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from sst_db import insert_batch, mark_data_changed, transaction_committed
+
+# Attempts per submission when the database connection fails, with the delay doubling between them
+JOB_MAX_ATTEMPTS = 4
+JOB_RETRY_DELAY = 2
+
+# Finished jobs kept for status display before the oldest are dropped
+JOB_HISTORY = 50
+
+# Process-wide queue shared by all sessions; jobs run one at a time in submission order
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sst-submit")
+jobs = {}
+jobs_lock = threading.Lock()
+
+def submit_insert_job(rows, labels, description=""):
+    """
+    Queue rows for insertion in the background and return the job id.
+    labels holds one display label per row for the outcome report.
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id,
+        'description': description,
+        'status': "queued",
+        'total': len(rows),
+        'done': 0,
+        'labels': list(labels),
+        'outcomes': [None] * len(rows),
+        'errors': [],
+        'submitted_at': time.time()
+    }
+    with jobs_lock:
+        jobs[job_id] = job
+        finished = [other for other in jobs.values() if other['status'] == "finished"]
+        for old_job in sorted(finished, key=lambda other: other['submitted_at'])[:-JOB_HISTORY]:
+            del jobs[old_job['id']]
+    executor.submit(run_insert_job, job, rows)
+    return job_id
+
+def insert_with_retries(rows, job):
+    """
+    Insert the rows in one transaction, retrying when the connection fails; on failure every row is
+    marked "failed" and none is stored. The job's progress counts the rows written in the current attempt.
+    """
+    delay = JOB_RETRY_DELAY
+    pending = {}
+    for attempt in range(1, JOB_MAX_ATTEMPTS + 1):
+        try:
+            # The connection can be lost after the commit went through; the rows then count as inserted
+            # by this job, not as duplicates of themselves, and cached reads must see them
+            if pending and transaction_committed(pending['txid']):
+                if "inserted" in pending['outcomes']:
+                    mark_data_changed()
+                return pending['outcomes']
+            pending.clear()
+            return insert_batch(rows, pending, progress=lambda done: job.update(done=done))
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if attempt == JOB_MAX_ATTEMPTS:
+                job['errors'].append(f"Database unavailable after {attempt} attempts: {e}")
+                return ["failed"] * len(rows)
+            time.sleep(delay)
+            delay *= 2
+        except Exception as e:
+            job['errors'].append(f"An error occurred: {e}")
+            return ["failed"] * len(rows)
+
+def run_insert_job(job, rows):
+    job['status'] = "running"
+    # Like a single upload, the whole submission is stored or none of it, so a retry never finds half of it
+    job['outcomes'] = insert_with_retries(rows, job)
+    job['done'] = len(rows)
+    job['status'] = "finished"
+
+def get_job(job_id):
+    """Snapshot of a job's status, or None when it is unknown (e.g. after a restart)"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        return dict(job, outcomes=list(job['outcomes']), errors=list(job['errors']))
@@ -0,0 +1,155 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("sst_metrics")
+
+# Prometheus text file with this process's stage timings and counters, for a local scraper
+# such as the node_exporter textfile collector
+METRICS_PATH = os.getenv('METRICS_PATH', os.path.join(os.path.dirname(__file__), '..', 'metrics', 'sst_metrics.prom'))
+
+# Seconds between rewrites of the metrics file
+METRICS_WRITE_SECONDS = int(os.getenv('METRICS_WRITE_SECONDS', 15))
+
+# Most recent durations kept per stage for the percentiles
+METRICS_SAMPLES = 1000
+
+# Process-wide measurements shared by all sessions and threads
+stage_samples = defaultdict(lambda: deque(maxlen=METRICS_SAMPLES))  # stage -> recent durations in seconds
+stage_totals = defaultdict(lambda: [0, 0.0])  # stage -> [runs, seconds] since the process started
+counters = defaultdict(float)  # (counter, stage) -> value
+metrics_lock = threading.Lock()
+
+def log_to_stderr(level=logging.INFO):
+    """
+    Write the per-stage log lines to stderr. For the Streamlit app, which does not configure logging;
+    the command line tools use logging.basicConfig(). Safe to call on every rerun.
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        # The lines are written once, even if the root logger gets a handler later
+        logger.propagate = False
+    logger.setLevel(level)
+
+def increment(counter, stage, value=1):
+    """Add value to a counter, exported as sst_<counter>_total{stage="..."}"""
+    with metrics_lock:
+        counters[(counter, stage)] += value
+
+def record(stage, seconds, rows=None, size=None):
+    """Record one run of stage that took seconds, with the rows and bytes it processed when known"""
+    with metrics_lock:
+        stage_samples[stage].append(seconds)
+        totals = stage_totals[stage]
+        totals[0] += 1
+        totals[1] += seconds
+        if rows is not None:
+            counters[('rows', stage)] += rows
+        if size is not None:
+            counters[('bytes', stage)] += size
+    logger.info("stage=%s seconds=%.4f rows=%s bytes=%s", stage, seconds,
+                "-" if rows is None else rows, "-" if size is None else size)
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    Time the block as one run of stage. The block can set 'rows' and 'bytes' in the yielded dict
+    to count what it processed. Exceptions are counted in sst_errors_total and raised again.
+    """
+    info = {}
+    start = time.perf_counter()
+    try:
+        yield info
+    except Exception:
+        increment('errors', stage)
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, info.get('rows'), info.get('bytes'))
+
+def frame_bytes(df):
+    """Memory held by a frame's columns; strings are counted by reference, which keeps it cheap"""
+    return int(df.memory_usage(index=False).sum())
+
+def read_sql_timed(stage, query, conn, params=None):
+    """pd.read_sql_query() timed as stage, counting the rows and bytes read"""
+    with timed(stage) as info:
+        df = pd.read_sql_query(query, conn, params=params)
+        info['rows'] = len(df)
+        info['bytes'] = frame_bytes(df)
+    return df
+
+def stage_summary():
+    """Per stage: runs, p50 and p95 of the recent durations in milliseconds, total seconds, rows and bytes"""
+    with metrics_lock:
+        samples = {stage: np.array(durations) for stage, durations in stage_samples.items()}
+        totals = {stage: tuple(values) for stage, values in stage_totals.items()}
+        counted = dict(counters)
+    summary = []
+    for stage in sorted(samples):
+        p50, p95 = np.percentile(samples[stage], [50, 95]) * 1000
+        summary.append({
+            'Stage': stage,
+            'Runs': totals[stage][0],
+            'p50 (ms)': round(p50, 1),
+            'p95 (ms)': round(p95, 1),
+            'Total (s)': round(totals[stage][1], 2),
+            'Rows': int(counted.get(('rows', stage), 0)),
+            'Bytes': int(counted.get(('bytes', stage), 0)),
+            'Errors': int(counted.get(('errors', stage), 0))
+        })
+    return summary
+
+def render_prometheus():
+    """The measurements in the Prometheus text exposition format"""
+    with metrics_lock:
+        samples = {stage: np.array(durations) for stage, durations in stage_samples.items()}
+        totals = {stage: tuple(values) for stage, values in stage_totals.items()}
+        counted = dict(counters)
+
+    lines = [
+        "# HELP sst_stage_seconds Time spent per stage; quantiles over the most recent runs",
+        "# TYPE sst_stage_seconds summary"
+    ]
+    for stage in sorted(samples):
+        for quantile in (0.5, 0.95):
+            value = np.percentile(samples[stage], quantile * 100)
+            lines.append(f'sst_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.6f}')
+        lines.append(f'sst_stage_seconds_sum{{stage="{stage}"}} {totals[stage][1]:.6f}')
+        lines.append(f'sst_stage_seconds_count{{stage="{stage}"}} {totals[stage][0]}')
+
+    for counter in sorted({counter for counter, _ in counted}):
+        lines.append(f"# TYPE sst_{counter}_total counter")
+        for (name, stage), value in sorted(counted.items()):
+            if name == counter:
+                lines.append(f'sst_{counter}_total{{stage="{stage}"}} {value:g}')
+    return "\n".join(lines) + "\n"
+
+def write_metrics_file(path=METRICS_PATH):
+    """Write the metrics atomically, so a scraper never reads a half-written file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+def start_metrics_writer(path=METRICS_PATH, interval=METRICS_WRITE_SECONDS):
+    """Rewrite the metrics file every interval seconds in a background thread; returns the thread"""
+    def write_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics_file(path)
+            except Exception as e:
+                logger.warning("Could not write metrics to %s: %s", path, e)
+
+    thread = threading.Thread(target=write_loop, name="sst-metrics", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from sst_db import MASS_ERROR_LIMIT_PPM, SCHEMA_MIGRATIONS, SEARCH_COLUMNS, build_data_query, build_id_summary_query, ensure_schema, get_connection
+from sst_metrics import read_sql_timed, timed
+
+logger = logging.getLogger("sst_snapshot")
+
+# Local copy of the "Data" table in Arrow IPC format; notebooks can open it with pd.read_feather()
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', os.path.join(os.path.dirname(__file__), '..', 'snapshot', 'sst_data.arrow'))
+
+# Seconds between background refreshes of the snapshot from the database
+SNAPSHOT_REFRESH_SECONDS = int(os.getenv('SNAPSHOT_REFRESH_SECONDS', 300))
+
+# Columns kept in the snapshot
+SNAPSHOT_COLUMNS = ("ID", "Date", "Instrument", "Response", "Masserrorppm", "Peptide", "Samplename", "Kommentar")
+
+def prepare_rows(df):
+    """Type the columns of freshly read rows; dates already arrive as datetimes, names are normalized when stored"""
+    with timed("parse_rows") as info:
+        info['rows'] = len(df)
+        # Only an empty or all-NULL column comes back without a datetime type
+        if 'Date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['Date']):
+            df['Date'] = pd.to_datetime(df['Date'])
+
+        # Numeric columns arrive as Decimal objects; floats are stored column-wise in the snapshot
+        for column in ('Response', 'Masserrorppm'):
+            if column in df.columns:
+                df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    return df
+
+def sync_frame(df, columns, since=None, instruments=None, peptides=None):
+    """
+    Bring a previously loaded frame up to date by reading only the rows with a higher ID.
+    Deleted rows, and rows committed out of ID order, are found by comparing the count and sum
+    of the IDs, and only then is the ID list read. Without a previous frame everything is read.
+    Returns the same frame object when nothing changed.
+    """
+    ensure_schema()
+    with get_connection() as conn:
+        if df is None or df.empty:
+            query, params = build_data_query(columns, since, instruments, peptides)
+            df = prepare_rows(read_sql_timed("db_fetch_rows", query, conn, params))
+            return df.sort_values('Date', kind='stable', ignore_index=True)
+
+        watermark = int(df['ID'].max())
+        new_parts = []
+        cursor = conn.cursor()
+        query, params = build_id_summary_query(watermark, since, instruments, peptides)
+        with timed("db_fetch_id_summary"):
+            cursor.execute(query, params)
+            count, id_sum = cursor.fetchone()
+        if count != len(df) or int(id_sum) != int(df['ID'].sum()):
+            query, params = build_data_query(("ID",), since, instruments, peptides)
+            with timed("db_fetch_ids") as info:
+                cursor.execute(query, params)
+                stored_ids = {row[0] for row in cursor.fetchall()}
+                info['rows'] = len(stored_ids)
+            df = df[df['ID'].isin(stored_ids)]
+            missing_ids = {id_number for id_number in stored_ids if id_number <= watermark}.difference(df['ID'])
+            if missing_ids:
+                query, params = build_data_query(columns, since, instruments, peptides, ids=missing_ids)
+                new_parts.append(read_sql_timed("db_fetch_rows", query, conn, params))
+        cursor.close()
+
+        query, params = build_data_query(columns, since, instruments, peptides, after_id=watermark)
+        new_parts.append(read_sql_timed("db_fetch_rows", query, conn, params))
+
+    new_rows = [prepare_rows(part) for part in new_parts if not part.empty]
+    if not new_rows:
+        return df
+    # Only the new rows are prepared; the stable sort is close to linear as the old rows are already in order
+    return pd.concat([df, *new_rows], ignore_index=True).sort_values('Date', kind='stable', ignore_index=True)
+
+def filter_frame(df, columns, since=None, instruments=None, peptides=None):
+    """The rows and columns build_data_query() would select, taken from a loaded frame"""
+    mask = pd.Series(True, index=df.index)
+    if since is not None:
+        mask &= df['Date'] >= pd.Timestamp(since)
+    if instruments is not None:
+        mask &= df['Instrument'].isin(instruments)
+    if peptides is not None:
+        mask &= df['Peptide'].isin(peptides)
+    return df.loc[mask, list(columns)].reset_index(drop=True)
+
+def page_frame(df, columns, sort_column, descending, after, limit,
+               since=None, instruments=None, peptides=None, search=None):
+    """The page build_table_page_query() would select, taken from a loaded frame"""
+    df = filter_frame(df, df.columns, since, instruments, peptides)
+    if search:
+        searched = df[list(SEARCH_COLUMNS)].fillna("").astype(str).agg(" ".join, axis=1)
+        df = df[searched.str.contains(search, case=False, regex=False)]
+
+    sort_values = df[sort_column]
+    if after is not None:
+        value, last_id = after
+        if descending and value is None:
+            keep = sort_values.notna() | (df['ID'] < last_id)
+        elif descending:
+            keep = sort_values.notna() & ((sort_values < value) | ((sort_values == value) & (df['ID'] < last_id)))
+        elif value is None:
+            keep = sort_values.isna() & (df['ID'] > last_id)
+        else:
+            keep = sort_values.isna() | (sort_values > value) | ((sort_values == value) & (df['ID'] > last_id))
+        df = df[keep]
+
+    df = df.sort_values([sort_column, 'ID'], ascending=not descending, na_position='first' if descending else 'last')
+    return df.head(limit)[list(columns)].reset_index(drop=True)
+
+# pandas periods matching the date_trunc() units of build_rollup_query(); weeks start on Monday
+ROLLUP_PERIODS = {'day': 'D', 'week': 'W-SUN', 'month': 'M'}
+
+# Aggregate columns of a rollup frame besides the means in "Masserrorppm" and "Response"
+ROLLUP_COLUMNS = ("Count", "OutOfLimit", "MasserrorMin", "MasserrorMax", "ResponseMin", "ResponseMax")
+
+def prepare_rollup(df):
+    """Numeric aggregates arrive as Decimal objects; they are plotted as floats"""
+    for column in ("Masserrorppm", "Response", *ROLLUP_COLUMNS):
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    return df
+
+def rollup_frame(df, bucket, since=None, instruments=None, peptides=None):
+    """The aggregates build_rollup_query() would select, computed from a loaded frame"""
+    df = filter_frame(df, ("Instrument", "Peptide", "Date", "Masserrorppm", "Response"), since, instruments, peptides)
+    df = df.dropna(subset=["Instrument", "Peptide", "Date"])
+    df = df.assign(
+        Date=df['Date'].dt.to_period(ROLLUP_PERIODS[bucket]).dt.start_time,
+        OutOfLimit=df['Masserrorppm'].abs() > MASS_ERROR_LIMIT_PPM
+    )
+    rollup = df.groupby(["Instrument", "Peptide", "Date"]).agg(
+        Count=('Masserrorppm', 'size'),
+        OutOfLimit=('OutOfLimit', 'sum'),
+        Masserrorppm=('Masserrorppm', 'mean'),
+        MasserrorMin=('Masserrorppm', 'min'),
+        MasserrorMax=('Masserrorppm', 'max'),
+        Response=('Response', 'mean'),
+        ResponseMin=('Response', 'min'),
+        ResponseMax=('Response', 'max')
+    ).reset_index()
+    return prepare_rollup(rollup.sort_values('Date', kind='stable', ignore_index=True))
+
+# Schema version the snapshot was written under; migrations can rewrite stored rows, which the ID sync does not see
+SNAPSHOT_SCHEMA_KEY = b'sst_schema_version'
+SNAPSHOT_SCHEMA_VERSION = str(SCHEMA_MIGRATIONS[-1][0]).encode()
+
+def read_snapshot(path=SNAPSHOT_PATH):
+    """Memory-map the snapshot file; returns None when there is none yet or it predates the current schema"""
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    if (table.schema.metadata or {}).get(SNAPSHOT_SCHEMA_KEY) != SNAPSHOT_SCHEMA_VERSION:
+        logger.info("Snapshot %s was written under an older schema and is read again from the database", path)
+        return None
+    return table.to_pandas()
+
+def write_snapshot(df, path=SNAPSHOT_PATH):
+    """Write the snapshot atomically, uncompressed so it can be memory-mapped"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SNAPSHOT_SCHEMA_KEY: SNAPSHOT_SCHEMA_VERSION})
+    tmp_path = path + ".tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+def refresh_snapshot(state, path=SNAPSHOT_PATH):
+    """Sync the snapshot in state with the database and rewrite the file when it changed"""
+    with timed("snapshot_refresh"):
+        synced = sync_frame(state['frame'], SNAPSHOT_COLUMNS)
+    if synced is not state['frame']:
+        with timed("snapshot_write") as info:
+            write_snapshot(synced, path)
+            info['rows'] = len(synced)
+            info['bytes'] = os.path.getsize(path)
+        state['frame'] = synced
+    state['refreshed_at'] = pd.Timestamp.now()
+
+def start_snapshot_refresh(path=SNAPSHOT_PATH, interval=SNAPSHOT_REFRESH_SECONDS):
+    """
+    Load the snapshot file and keep it up to date in a background thread.
+    Returns the shared state: {'frame': DataFrame or None, 'refreshed_at': time of the last successful refresh}.
+    """
+    state = {'frame': None, 'refreshed_at': None}
+    try:
+        state['frame'] = read_snapshot(path)
+        if state['frame'] is not None:
+            state['refreshed_at'] = pd.Timestamp.fromtimestamp(os.path.getmtime(path))
+    except Exception as e:
+        logger.warning("Could not read snapshot %s: %s", path, e)
+
+    def refresh_loop():
+        while True:
+            try:
+                refresh_snapshot(state, path)
+            except Exception as e:
+                # The database may be unreachable; the snapshot stays as it is until the next attempt
+                logger.warning("Snapshot refresh failed: %s", e)
+            time.sleep(interval)
+
+    threading.Thread(target=refresh_loop, name="sst-snapshot", daemon=True).start()
+    return state
@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import psycopg2
+
+from sst_csv import build_insert_rows, validate_csv_file
+from sst_db import ensure_schema, insert_batch
+from sst_metrics import start_metrics_writer, write_metrics_file
+
+logger = logging.getLogger("watch_exports")
+
+# Name of the file in the watched directory that records processed exports
+STATE_FILENAME = ".skywalker_ingested.json"
+
+def load_state(state_path):
+    """Return the record of processed files: {content hash: details}"""
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state, state_path):
+    """Write the record atomically so a crash never leaves a half-written file"""
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+def ingest_file(path, content, fallback_instrument=None):
+    """
+    Validate one export with the same format and instrument detection as the page and bulk insert it.
+    Returns a dict with the outcome counts, or the validation errors.
+    """
+    filename = os.path.basename(path)
+    result = validate_csv_file(filename, content)
+    df = result['df']
+
+    if result['errors']:
+        return {'status': "invalid", 'errors': result['errors']}
+    if df is None:
+        return {'status': "invalid", 'errors': ["Columns could not be mapped automatically"]}
+
+    instrument = result['instrument'] or fallback_instrument
+    if instrument is None and 'item_description' not in df.columns:
+        return {'status': "invalid", 'errors': ["No instrument in filename - use --instrument to set a fallback"]}
+
+    # Without a fallback, every row must name its instrument in the Item description
+    rows = build_insert_rows(df, instrument, [""] * len(df))
+    missing = [f"Row {index+1}: No instrument in Item description - use --instrument to set a fallback"
+               for index, row in zip(df.index, rows) if row["Instrument"] is None]
+    if missing:
+        return {'status': "invalid", 'errors': missing}
+
+    outcomes = insert_batch(rows)
+    return {
+        'status': "ingested",
+        'inserted': outcomes.count("inserted"),
+        'duplicates': outcomes.count("duplicate")
+    }
+
+def is_processed(record, fallback_instrument):
+    """
+    Whether a recorded file is done. Invalid files are read again when the fallback instrument
+    changes, as a missing instrument is fixed by --instrument.
+    """
+    return record['status'] != "invalid" or record.get('fallback_instrument') == fallback_instrument
+
+def scan_directory(directory, state, fallback_instrument=None, settle_seconds=5):
+    """
+    Ingest every CSV in directory that is not in state yet. Files modified less than
+    settle_seconds ago are left for the next scan, as the instrument may still be writing them.
+    Returns True when state changed.
+    """
+    changed = False
+    now = time.time()
+    # Files whose name, size and modification time are recorded are skipped without reading them
+    known_files = {(record['filename'], record['size'], record['mtime'])
+                   for record in state.values() if is_processed(record, fallback_instrument)}
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if not entry.is_file() or not entry.name.lower().endswith(".csv"):
+            continue
+        stat = entry.stat()
+        if now - stat.st_mtime < settle_seconds:
+            continue
+        if (entry.name, stat.st_size, stat.st_mtime) in known_files:
+            continue
+
+        with open(entry.path, 'rb') as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash in state and is_processed(state[content_hash], fallback_instrument):
+            # Same content under a new name or timestamp, e.g. a copied export
+            continue
+
+        try:
+            record = ingest_file(entry.path, content, fallback_instrument)
+        except psycopg2.Error as e:
+            # Database errors are retried on the next scan, so nothing is recorded
+            logger.error("Failed to ingest %s: %s", entry.name, e)
+            continue
+        except Exception as e:
+            # Anything else fails again on every scan, so the file is recorded as failed
+            record = {'status': "failed", 'errors': [f"Unexpected error: {e}"]}
+
+        if record['status'] == "ingested":
+            logger.info("Ingested %s: %d inserted, %d duplicates", entry.name, record['inserted'], record['duplicates'])
+        else:
+            logger.warning("Skipped %s: %s", entry.name, "; ".join(record['errors']))
+
+        record.update({
+            'filename': entry.name,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'fallback_instrument': fallback_instrument,
+            'processed_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        state[content_hash] = record
+        changed = True
+    return changed
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch an instrument export directory and ingest new SST CSV files.")
+    parser.add_argument("directory", help="Directory the instrument software exports CSV files to")
+    parser.add_argument("--instrument", choices=["Luke", "Leia"], help="Instrument used when it is not in the filename or Item description")
+    parser.add_argument("--interval", type=float, default=10, help="Seconds between directory scans (default: 10)")
+    parser.add_argument("--settle", type=float, default=5, help="Seconds a file must be unchanged before it is read (default: 5)")
+    parser.add_argument("--state-file", help=f"Record of processed files (default: <directory>/{STATE_FILENAME})")
+    parser.add_argument("--once", action="store_true", help="Scan the directory once and exit")
+    parser.add_argument("--metrics-file", help="Write Prometheus metrics for the validation and inserts to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # An out-of-date schema would fail every file, so the watcher does not start until migrate_db.py has run
+    try:
+        ensure_schema()
+    except RuntimeError as e:
+        logger.error("%s", e)
+        raise SystemExit(1)
+    except psycopg2.Error as e:
+        logger.warning("Could not check the schema, the database is unreachable: %s", e)
+
+    state_path = args.state_file or os.path.join(args.directory, STATE_FILENAME)
+    state = load_state(state_path)
+    logger.info("Watching %s (%d files already processed)", args.directory, len(state))
+    if args.metrics_file:
+        start_metrics_writer(args.metrics_file)
+
+    try:
+        while True:
+            if scan_directory(args.directory, state, args.instrument, args.settle):
+                save_state(state, state_path)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+    finally:
+        if args.metrics_file:
+            write_metrics_file(args.metrics_file)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app modules live in src/ and import each other by name, as they do when Streamlit runs them
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
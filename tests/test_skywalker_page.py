@@ -0,0 +1,31 @@
+import os
+
+import psycopg2
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import sst_db
+import sst_metrics
+
+PAGE_PATH = os.path.join(os.path.dirname(__file__), '..', 'src', 'pages', 'Skywalker_SST.py')
+
+@pytest.fixture
+def page(monkeypatch):
+    """The page against the database in .env, without the metrics file writer"""
+    try:
+        sst_db.ensure_schema()
+    except (psycopg2.OperationalError, RuntimeError) as e:
+        pytest.skip(f"Database not available: {e}")
+    monkeypatch.setattr(sst_metrics, "start_metrics_writer", lambda *args, **kwargs: None)
+    return AppTest.from_file(PAGE_PATH, default_timeout=120)
+
+def test_selecting_peptides_draws_the_charts(page):
+    page.run()
+    peptides = [widget for widget in page.multiselect if widget.label.startswith("🧪")][0]
+    if not peptides.options:
+        pytest.skip("No peptides in the database")
+
+    peptides.set_value(peptides.options[:1]).run()
+    assert not page.exception
+    assert not page.error
+    assert page.get("plotly_chart")
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sst_charts import downsample_frame, lttb_indices
+
+@pytest.mark.parametrize("n, threshold", [(10, 3), (100, 7), (1000, 100), (1001, 1000), (5000, 1000)])
+def test_lttb_keeps_the_endpoints_within_the_budget(n, threshold):
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.uniform(0.5, 2.0, n))
+    kept = lttb_indices(x, rng.normal(size=n), threshold)
+
+    assert len(kept) == threshold
+    assert kept[0] == 0 and kept[-1] == n - 1
+    # One point per bucket, so the positions are distinct and in order
+    assert np.all(np.diff(kept) > 0)
+
+@pytest.mark.parametrize("threshold", [2, 10, 11])
+def test_lttb_keeps_every_point_when_it_cannot_reduce(threshold):
+    assert list(lttb_indices(np.arange(10), np.zeros(10), threshold)) == list(range(10))
+
+def test_lttb_keeps_a_spike():
+    y = np.zeros(1000)
+    y[437] = 50.0
+    assert 437 in lttb_indices(np.arange(1000), y, 20)
+
+def test_downsample_frame_drops_empty_values_and_keeps_dates_in_order():
+    df = pd.DataFrame({
+        'Date': pd.date_range("2025-01-01", periods=3000, freq="h"),
+        'Response': np.sin(np.arange(3000) / 50.0)
+    })
+    df.loc[::7, 'Response'] = np.nan
+
+    sampled = downsample_frame(df, 'Date', 'Response', 500)
+
+    assert len(sampled) == 500
+    assert sampled['Response'].notna().all()
+    assert sampled['Date'].is_monotonic_increasing
+    valid = df[df['Response'].notna()]
+    assert sampled.index[0] == valid.index[0] and sampled.index[-1] == valid.index[-1]
+
+def test_downsample_frame_returns_small_frames_whole():
+    df = pd.DataFrame({'Date': pd.date_range("2025-01-01", periods=5), 'Response': [1.0, np.nan, 3.0, 4.0, 5.0]})
+    assert list(downsample_frame(df, 'Date', 'Response', 1000).index) == [0, 2, 3, 4]
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+from sst_csv import build_insert_rows, validate_csv_format, validate_standardized_rows
+
+def standardized(responses, mass_errors):
+    return pd.DataFrame({
+        'sample_id': [f"SST_sample_{index}" for index in range(len(responses))],
+        'peptide': ["Digest1"] * len(responses),
+        'component': ["Digest1"] * len(responses),
+        'response': responses,
+        'mass_error': mass_errors
+    })
+
+@pytest.mark.parametrize("value", ["inf", "-inf", "-Infinity"])
+def test_non_finite_response_is_rejected(value):
+    df, errors = validate_standardized_rows(standardized(["691565", value], ["1.3", "0.5"]))
+    assert errors == [f"Row 2: Response must be a finite number: '{value}'"]
+
+@pytest.mark.parametrize("value", ["inf", "-inf"])
+def test_non_finite_mass_error_is_rejected(value):
+    df, errors = validate_standardized_rows(standardized(["691565", "700000"], [value, "0.5"]))
+    assert errors == [f"Row 1: Mass error must be a finite number: '{value}'"]
+
+def test_non_finite_numeric_column_is_rejected():
+    df, errors = validate_standardized_rows(standardized([691565.0, float("inf")], [1.3, float("-inf")]))
+    assert errors == ["Row 2: Response must be a finite number: 'inf'; Mass error must be a finite number: '-inf'"]
+
+def test_empty_and_nan_cells_are_reported_as_missing():
+    df, errors = validate_standardized_rows(standardized([None, "", "NaN"], ["1.3", float("nan"), "0.5"]))
+    assert errors == [
+        "Row 1: Missing Response",
+        "Row 2: Missing Response; Missing Mass error",
+        "Row 3: Invalid Response value: 'NaN'"
+    ]
+
+@pytest.mark.parametrize("value, message", [
+    ("inf", "Response must be a finite number: 'inf'"),
+    ("-inf", "Response must be a finite number: '-inf'"),
+    # read_csv leaves an overflowing number as text, which does not parse
+    ("1e999", "Invalid Response value: '1e999'"),
+])
+def test_non_finite_value_in_csv_is_a_row_error(value, message):
+    content = "Item Name CC,Description CC,Component name,Response,Mass error (ppm)\n" \
+              "SST_sample_001,Digest1,Digest1,691565,1.3\n" \
+              f"SST_sample_002,Digest1,Digest1,{value},1.3\n"
+    df, errors, warnings, column_info = validate_csv_format(content)
+    assert df is None
+    assert errors == [f"Row 2: {message}"]
+
+def test_valid_rows_build_insert_rows():
+    df, errors = validate_standardized_rows(standardized(["691565,4", "700000"], ["1,3", "-0.5"]))
+    assert errors == []
+    rows = build_insert_rows(df, "Luke", ["", "lamp change"])
+    assert [row["Response"] for row in rows] == [691565, 700000]
+    assert [row["Masserrorppm"] for row in rows] == [1.3, -0.5]
+    assert [row["Kommentar"] for row in rows] == ["", "lamp change"]
@@ -0,0 +1,144 @@
+import contextlib
+
+import psycopg2
+import pytest
+
+import sst_db
+
+class FakeConnection:
+    """Connection whose rollback fails, as when the server went away mid-transaction"""
+    closed = 0
+
+    def rollback(self):
+        raise psycopg2.InterfaceError("connection already closed")
+
+class FakePool:
+    def __init__(self):
+        self.returned = []
+
+    def getconn(self):
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        self.returned.append(close)
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(sst_db, "get_pool", lambda: pool)
+    monkeypatch.setattr(sst_db, "is_healthy", lambda conn: True)
+    return pool
+
+def test_failed_rollback_returns_the_connection_closed(fake_pool):
+    for _ in range(sst_db.POOL_MAX_CONNECTIONS + 1):
+        with sst_db.get_connection():
+            pass
+    assert fake_pool.returned == [True] * (sst_db.POOL_MAX_CONNECTIONS + 1)
+
+def test_error_in_block_is_raised_after_a_failed_rollback(fake_pool):
+    with pytest.raises(ValueError):
+        with sst_db.get_connection():
+            raise ValueError("bad row")
+    assert fake_pool.returned == [True]
+
+class FakeCursor:
+    """Cursor over a "SchemaMigrations" table holding the given versions; fails on anything else"""
+    def __init__(self, versions):
+        self.versions = versions
+        self.result = None
+
+    def execute(self, query, params=None):
+        if "to_regclass" in query:
+            self.result = [(self.versions is not None,)]
+        elif query == 'SELECT "Version" FROM "SchemaMigrations"':
+            self.result = [(version,) for version in self.versions]
+        else:
+            raise AssertionError(f"Unexpected statement: {query}")
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def schema_versions(monkeypatch):
+    """Set the versions the fake database has applied; None means no "SchemaMigrations" table"""
+    state = {'versions': None}
+
+    @contextlib.contextmanager
+    def fake_connection():
+        conn = type("Conn", (), {})()
+        conn.cursor = lambda: FakeCursor(state['versions'])
+        yield conn
+
+    monkeypatch.setattr(sst_db, "get_connection", fake_connection)
+    sst_db.ensure_schema.cache_clear()
+    yield state
+    sst_db.ensure_schema.cache_clear()
+
+def test_ensure_schema_asks_for_migrate_db_without_migrating(schema_versions):
+    schema_versions['versions'] = [1, 2]
+    with pytest.raises(RuntimeError, match="migrate_db.py"):
+        sst_db.ensure_schema()
+
+def test_ensure_schema_without_migrations_table(schema_versions):
+    with pytest.raises(RuntimeError, match="pending migrations: 1, 2"):
+        sst_db.ensure_schema()
+
+def test_ensure_schema_passes_once_migrated(schema_versions):
+    schema_versions['versions'] = [version for version, _, _ in sst_db.SCHEMA_MIGRATIONS]
+    assert sst_db.ensure_schema()
+
+@pytest.mark.parametrize("value, expected", [
+    ("Digest1", "Digest1"),
+    ("  digest1_ ", "Digest1"),
+    ("APOMYOGLOBIN", "Apomyoglobin"),
+    ("Digest1__", "Digest1_"),
+    ("Custom peptide_", "Custom peptide"),
+    (None, None),
+])
+def test_normalize_name(value, expected):
+    assert sst_db.normalize_name(value, sst_db.CANONICAL_PEPTIDES) == expected
+
+# Tied and empty sort values, with the IDs out of order
+TABLE_RESPONSES = [5, None, 3, 5, None, 3, 7, 5, None, 1]
+TABLE_IDS = [4, 9, 1, 10, 2, 7, 3, 6, 5, 8]
+
+@pytest.fixture
+def table_cursor():
+    """Cursor on a temporary "Data" holding the rows above; it hides the real table and is rolled back"""
+    try:
+        with sst_db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+            CREATE TEMP TABLE "Data" ("ID" integer, "Date" timestamptz, "Instrument" text, "Response" numeric,
+                "Masserrorppm" numeric, "Peptide" text, "Samplename" text, "Kommentar" text)
+            """)
+            cursor.executemany('INSERT INTO "Data" ("ID", "Response", "Instrument") VALUES (%s, %s, %s)',
+                               [(row_id, response, "Luke") for row_id, response in zip(TABLE_IDS, TABLE_RESPONSES)])
+            yield cursor
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Database not available: {e}")
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 2, 3, 4])
+def test_table_pages_hold_every_row_once_in_order(table_cursor, descending, limit):
+    seen = []
+    after = None
+    while True:
+        query, params = sst_db.build_table_page_query(("ID", "Response"), "Response", descending, after, limit)
+        table_cursor.execute(query, params)
+        page = table_cursor.fetchall()
+        seen.extend(row_id for row_id, _ in page)
+        if len(page) < limit:
+            break
+        after = (page[-1][1], page[-1][0])
+        assert len(seen) <= len(TABLE_IDS), "paging does not end"
+
+    # Empty values are the largest, ties are ordered by ID
+    rows = sorted(zip(TABLE_RESPONSES, TABLE_IDS), key=lambda row: (row[0] is None, row[0] or 0, row[1]))
+    assert seen == [row_id for _, row_id in (rows[::-1] if descending else rows)]
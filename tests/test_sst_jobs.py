@@ -0,0 +1,57 @@
+import psycopg2
+
+import sst_jobs
+
+ROWS = [{"Peptide": "Digest1"}, {"Peptide": "Digest2"}]
+
+def lose_connection_after(committed, calls):
+    """insert_batch() stand-in whose first call loses the connection during the commit"""
+    def insert_batch(rows, pending=None, progress=None):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            pending.update(txid=1234, outcomes=["inserted", "duplicate"])
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return ["duplicate", "duplicate"] if committed else ["inserted", "duplicate"]
+    return insert_batch
+
+def test_commit_lost_in_transit_counts_as_inserted(monkeypatch):
+    calls, versions = [], []
+    monkeypatch.setattr(sst_jobs, "JOB_RETRY_DELAY", 0)
+    monkeypatch.setattr(sst_jobs, "insert_batch", lose_connection_after(True, calls))
+    monkeypatch.setattr(sst_jobs, "transaction_committed", lambda txid: txid == 1234)
+    monkeypatch.setattr(sst_jobs, "mark_data_changed", lambda: versions.append(1))
+    job = {'errors': []}
+
+    assert sst_jobs.insert_with_retries(ROWS, job) == ["inserted", "duplicate"]
+    assert calls == [2]
+    assert versions == [1]
+    assert job['errors'] == []
+
+def test_rolled_back_commit_is_inserted_again(monkeypatch):
+    calls, versions = [], []
+    monkeypatch.setattr(sst_jobs, "JOB_RETRY_DELAY", 0)
+    monkeypatch.setattr(sst_jobs, "insert_batch", lose_connection_after(False, calls))
+    monkeypatch.setattr(sst_jobs, "transaction_committed", lambda txid: False)
+    monkeypatch.setattr(sst_jobs, "mark_data_changed", lambda: versions.append(1))
+
+    assert sst_jobs.insert_with_retries(ROWS, {'errors': []}) == ["inserted", "duplicate"]
+    assert calls == [2, 2]
+    assert versions == []
+
+def test_job_inserts_every_row_in_one_transaction(monkeypatch):
+    calls, reported = [], []
+    job = {'status': "queued", 'done': 0, 'total': 1500, 'outcomes': [None] * 1500, 'errors': []}
+    def insert_batch(rows, pending=None, progress=None):
+        calls.append(len(rows))
+        for done in (1000, 1500):
+            progress(done)
+            reported.append(job['done'])
+        return ["inserted"] * len(rows)
+    monkeypatch.setattr(sst_jobs, "insert_batch", insert_batch)
+
+    sst_jobs.run_insert_job(job, [{"Peptide": "Digest1"}] * 1500)
+
+    assert calls == [1500]
+    assert reported == [1000, 1500]
+    assert job['status'] == "finished"
+    assert job['outcomes'] == ["inserted"] * 1500
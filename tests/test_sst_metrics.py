@@ -0,0 +1,17 @@
+import logging
+
+import sst_metrics
+
+def test_app_logging_emits_a_line_per_stage(monkeypatch, capsys):
+    # Start from the unconfigured logger a fresh app process has
+    monkeypatch.setattr(sst_metrics.logger, "handlers", [])
+    monkeypatch.setattr(sst_metrics.logger, "propagate", True)
+    monkeypatch.setattr(sst_metrics.logger, "level", logging.NOTSET)
+
+    sst_metrics.log_to_stderr()
+    sst_metrics.log_to_stderr()
+    sst_metrics.record("csv_validate", 0.25, rows=3)
+
+    lines = capsys.readouterr().err.splitlines()
+    assert len(lines) == 1
+    assert lines[0].endswith("INFO sst_metrics: stage=csv_validate seconds=0.2500 rows=3 bytes=-")
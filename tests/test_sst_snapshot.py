@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sst_snapshot import page_frame
+
+COLUMNS = ("ID", "Date", "Instrument", "Response", "Masserrorppm", "Peptide", "Samplename", "Kommentar")
+
+# Tied and empty sort values, with the IDs out of order
+RESPONSES = [5.0, np.nan, 3.0, 5.0, np.nan, 3.0, 7.0, 5.0, np.nan, 1.0]
+IDS = [4, 9, 1, 10, 2, 7, 3, 6, 5, 8]
+
+def table_frame():
+    return pd.DataFrame({
+        'ID': IDS,
+        'Date': pd.date_range("2025-01-01", periods=len(IDS), freq="D"),
+        'Instrument': "Luke",
+        'Response': RESPONSES,
+        'Masserrorppm': 1.0,
+        'Peptide': "Digest1",
+        'Samplename': "sample",
+        'Kommentar': ""
+    })
+
+def expected_order(descending):
+    """(sort value, ID) in table order: empty values are the largest, ties are ordered by ID"""
+    rows = sorted(zip(RESPONSES, IDS), key=lambda row: (np.isnan(row[0]), 0 if np.isnan(row[0]) else row[0], row[1]))
+    return [row_id for _, row_id in (rows[::-1] if descending else rows)]
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 2, 3, 4])
+def test_every_row_is_paged_once_in_order(descending, limit):
+    df = table_frame()
+    seen = []
+    after = None
+    while True:
+        page = page_frame(df, COLUMNS, "Response", descending, after, limit)
+        seen.extend(page['ID'])
+        if len(page) < limit:
+            break
+        value = page['Response'].iloc[-1]
+        after = (None if pd.isna(value) else float(value), int(page['ID'].iloc[-1]))
+        assert len(seen) <= len(IDS), "paging does not end"
+
+    assert seen == expected_order(descending)
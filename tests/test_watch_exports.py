@@ -0,0 +1,55 @@
+import watch_exports
+
+COMPONENT_HEADER = "Component,Mass error,MS response,Item description\n"
+
+def test_rows_without_instrument_make_the_file_invalid(monkeypatch):
+    inserted = []
+    monkeypatch.setattr(watch_exports, "insert_batch", inserted.append)
+    content = (COMPONENT_HEADER +
+               "Digest1,1.3,691565,Luke-20240101-sst\n"
+               "Digest2,0.4,700000,Unknown-20240101-sst\n").encode('utf-8')
+
+    record = watch_exports.ingest_file("/exports/sst_export.csv", content)
+
+    assert record == {'status': "invalid", 'errors': [
+        "Row 2: No instrument in Item description - use --instrument to set a fallback"
+    ]}
+    assert inserted == []
+
+def test_fallback_instrument_fills_rows_without_one(monkeypatch):
+    inserted = []
+    monkeypatch.setattr(watch_exports, "insert_batch", lambda rows: inserted.extend(rows) or ["inserted"] * len(rows))
+    content = (COMPONENT_HEADER +
+               "Digest1,1.3,691565,Luke-20240101-sst\n"
+               "Digest2,0.4,700000,Unknown-20240101-sst\n").encode('utf-8')
+
+    record = watch_exports.ingest_file("/exports/sst_export.csv", content, fallback_instrument="Leia")
+
+    assert record['status'] == "ingested"
+    assert [row["Instrument"] for row in inserted] == ["Luke", "Leia"]
+
+def test_unexpected_errors_are_recorded_as_failed(tmp_path, monkeypatch):
+    def fail(path, content, fallback_instrument=None):
+        raise ValueError("boom")
+    monkeypatch.setattr(watch_exports, "ingest_file", fail)
+    (tmp_path / "luke_export.csv").write_text(COMPONENT_HEADER)
+    state = {}
+
+    assert watch_exports.scan_directory(str(tmp_path), state, settle_seconds=0)
+    [record] = state.values()
+    assert record['status'] == "failed" and record['errors'] == ["Unexpected error: boom"]
+
+def test_invalid_file_is_read_again_with_a_fallback(tmp_path, monkeypatch):
+    inserted = []
+    monkeypatch.setattr(watch_exports, "insert_batch", lambda rows: inserted.extend(rows) or ["inserted"] * len(rows))
+    (tmp_path / "sst_export.csv").write_text(COMPONENT_HEADER + "Digest2,0.4,700000,Unknown-20240101-sst\n")
+    state = {}
+
+    assert watch_exports.scan_directory(str(tmp_path), state, settle_seconds=0)
+    assert [record['status'] for record in state.values()] == ["invalid"]
+    # Unchanged file and fallback: not read again
+    assert not watch_exports.scan_directory(str(tmp_path), state, settle_seconds=0)
+
+    assert watch_exports.scan_directory(str(tmp_path), state, fallback_instrument="Leia", settle_seconds=0)
+    assert [record['status'] for record in state.values()] == ["ingested"]
+    assert [row["Instrument"] for row in inserted] == ["Leia"]